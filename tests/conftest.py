@@ -1,6 +1,8 @@
 import sys
 import os
 
+import pytest
+
 
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root_dir)
@@ -32,3 +34,10 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def sync_thumbnails(settings):
+    # Миниатюры строятся сразу: фоновые потоки пережили бы тест
+    # и писали бы во временный MEDIA_ROOT, который уже удаляется
+    settings.THUMBNAIL_PIPELINE = 'sync'
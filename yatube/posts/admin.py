@@ -1,13 +1,46 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.db.models import Q
 
-from .models import Follow, Group, Post, Comment
+from .models import Follow, Group, Post, Comment, User
+from .paginators import EstimatedCountPaginator
+from .search import get_backend
 
 
-class PostAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список для таблиц с миллионами строк: без полного COUNT(*)
+    (ни для страниц, ни для «показать все»), связанные объекты
+    читаются одним запросом через list_select_related"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = "-пусто-"
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        """Выборки с фильтром считаются от текущей страницы: страницы
+        за ADMIN_COUNT_LIMIT строк доступны по ссылкам пагинации"""
+        try:
+            page_num = max(int(request.GET.get(PAGE_VAR, 0)), 0)
+        except ValueError:
+            page_num = 0
+        return self.paginator(queryset, per_page, orphans=orphans,
+                              allow_empty_first_page=allow_empty_first_page,
+                              start=page_num * per_page)
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ("pk", "text", "pub_date", "author", "group")
+    list_select_related = ("author", "group")
     search_fields = ("text",)
     list_filter = ("pub_date",)
-    empty_value_display = "-пусто-"
+    autocomplete_fields = ("author", "group")
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по поисковому индексу вместо LIKE '%...%' по тексту"""
+        if not search_term:
+            return queryset, False
+        return get_backend().filter(queryset, search_term), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -17,18 +50,34 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ("pk", "text", "created", "author", "post")
-    search_fields = ("text", "post",)
+    list_select_related = ("author", "post")
+    search_fields = ("text", "author__username__exact")
     list_filter = ("created",)
-    empty_value_display = "-пусто-"
+    autocomplete_fields = ("author",)
+    raw_id_fields = ("post",)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ("pk", "user", "author")
-    search_fields = ("user", "author",)
-    list_filter = ("user",)
-    empty_value_display = "-пусто-"
+    list_select_related = ("user", "author")
+    # Фильтр по пользователю выводил бы всех пользователей списком,
+    # поэтому подписки пользователя находятся поиском по имени
+    search_fields = ("user__username__exact", "author__username__exact")
+    autocomplete_fields = ("user", "author")
+
+    def get_search_results(self, request, queryset, search_term):
+        """Подписки пользователя и на него по точному имени: условие
+        по id идёт по индексам внешних ключей, а не сканированием"""
+        if not search_term:
+            return queryset, False
+        user_id = User.objects.filter(
+            username=search_term.strip()).values_list("id", flat=True).first()
+        if user_id is None:
+            return queryset.none(), False
+        queryset = queryset.filter(Q(user_id=user_id) | Q(author_id=user_id))
+        return queryset, False
 
 
 admin.site.register(Post, PostAdmin)
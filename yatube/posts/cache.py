@@ -0,0 +1,99 @@
+"""Ключи и инвалидация кешированных фрагментов шаблонов.
+
+Ленты кешируются по поколениям: у каждой ленты (общей, группы, автора,
+подписок пользователя, комментариев поста) есть счётчик версии, который
+входит в ключ фрагмента и увеличивается при записи постов, подписок,
+комментариев и групп. Старые
+фрагменты не удаляются, а перестают читаться и истекают по TTL,
+поэтому время жизни можно держать большим.
+
+Записи идут в транзакции (см. views.py), поэтому сброс внутри неё
+повторяется после фиксации: иначе читатель, успевший между сбросом
+и фиксацией, закешировал бы старые данные под новым ключом"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import timeline
+from .models import Follow
+
+
+def _version_key(scope):
+    return f"feed-version:{scope}"
+
+
+def _initial_version():
+    # Версия, созданная после вытеснения ключа из кеша, не должна
+    # совпасть с одной из прежних, поэтому отсчёт идёт от времени
+    return int(time.time() * 1000)
+
+
+def feed_versions(*scopes):
+    """Текущие версии лент; недостающие создаются"""
+    keys = {_version_key(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        initial = _initial_version()
+        cache.add(key, initial, None)
+        versions[key] = cache.get(key, initial)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def feed_version(scope):
+    return feed_versions(scope)[scope]
+
+
+def post_feed_scopes(author_id, group_id):
+    """Ленты, в которых показывается пост. Посты автора, раскладываемые
+    по лентам подписчиков, меняют и их версии follow:<id>; ленты
+    подписок читателей популярного автора следят за author:<id>"""
+    scopes = ["index", f"author:{author_id}"]
+    if group_id:
+        scopes.append(f"group:{group_id}")
+    if not timeline.is_celebrity(author_id):
+        followers = Follow.objects.filter(
+            author_id=author_id).values_list("user_id", flat=True)
+        scopes += [f"follow:{user_id}" for user_id in followers.iterator()]
+    return scopes
+
+
+def _again_after_commit(function, *args):
+    """Вызывает function сейчас и ещё раз после фиксации транзакции"""
+    function(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: function(*args))
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), None)
+
+
+def bump_feed_versions(*scopes):
+    """Делает закешированные фрагменты указанных лент устаревшими"""
+    _again_after_commit(_bump, scopes)
+
+
+def follow_feed_version(user):
+    """Версия ленты подписок: меняется при подписке/отписке
+    пользователя и при записи постов любого из его авторов.
+
+    Обычные авторы меняют версию follow:<id> подписчика сами (см.
+    post_feed_scopes), поэтому отдельно читаются только версии
+    популярных авторов, чьи посты не раскладываются по лентам"""
+    followed = Follow.objects.filter(user=user).values_list(
+        "author_id", flat=True)
+    scopes = [f"follow:{user.pk}"]
+    scopes += [f"author:{author_id}"
+               for author_id in sorted(timeline.celebrity_ids(followed))]
+    versions = feed_versions(*scopes)
+    digest = hashlib.md5()
+    for scope in scopes:
+        digest.update(f"{scope}={versions[scope]};".encode())
+    return digest.hexdigest()
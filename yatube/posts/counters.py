@@ -0,0 +1,122 @@
+"""Денормализованные счётчики: пользователей (таблица UserCounters)
+и комментариев к посту (поле Post.comment_count).
+
+Счётчики меняются атомарным UPDATE ... SET n = n + delta из сигналов
+модели. Представления сайта и админка пишут посты, комментарии
+и подписки в транзакции, и счётчик меняется вместе с записью;
+расхождения после записей вне транзакции (shell, скрипты) исправляет
+команда reconcile_counters. Если строки счётчиков у пользователя ещё
+нет, она создаётся пересчётом по исходным таблицам.
+
+Счётчики не опускаются ниже нуля: записи, загруженные loaddata,
+не увеличивают их, но их удаление уменьшает"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Comment, Follow, Post, User, UserCounters
+
+# Поле счётчика -> (модель-источник, поле со ссылкой на пользователя)
+SOURCES = {
+    "post_count": (Post, "author"),
+    "follower_count": (Follow, "author"),
+    "following_count": (Follow, "user"),
+    "comment_count": (Comment, "author"),
+}
+
+
+def _count_by_user(field, user_ids=None):
+    model, user_field = SOURCES[field]
+    rows = model.objects.order_by().values(user_field)
+    if user_ids is not None:
+        rows = rows.filter(**{f"{user_field}__in": user_ids})
+    return dict(rows.annotate(total=Count("pk")).values_list(user_field,
+                                                             "total"))
+
+
+def actual_counters(user_ids):
+    """Считает значения счётчиков по исходным таблицам"""
+    actual = {user_id: UserCounters(user_id=user_id) for user_id in user_ids}
+    for field in SOURCES:
+        for user_id, total in _count_by_user(field, user_ids).items():
+            setattr(actual[user_id], field, total)
+    return actual
+
+
+def _shifted(field, delta):
+    return Greatest(F(field) + delta, 0)
+
+
+def _create_counters(user_id):
+    """Строка счётчиков, посчитанная по исходным таблицам, и признак
+    того, что её создал этот вызов, а не параллельный запрос"""
+    actual = actual_counters([user_id])[user_id]
+    return UserCounters.objects.get_or_create(
+        user_id=user_id,
+        defaults={field: getattr(actual, field) for field in SOURCES})
+
+
+def change(user_id, create_missing=True, **deltas):
+    """Изменяет счётчики пользователя на указанные величины"""
+    values = {field: _shifted(field, delta)
+              for field, delta in deltas.items()}
+    with transaction.atomic():
+        updated = UserCounters.objects.filter(user_id=user_id).update(
+            **values)
+        if updated or not create_missing:
+            return
+        # Пересчёт уже учитывает только что записанную строку, а строка
+        # параллельной транзакции — нет
+        if not _create_counters(user_id)[1]:
+            UserCounters.objects.filter(user_id=user_id).update(**values)
+
+
+def change_comment_count(post_id, delta):
+    """Изменяет счётчик комментариев поста"""
+    Post.objects.filter(pk=post_id).update(
+        comment_count=_shifted("comment_count", delta))
+
+
+def counters_for(user):
+    """Счётчики пользователя; отсутствующая строка пересчитывается"""
+    try:
+        return user.counters
+    except UserCounters.DoesNotExist:
+        return _create_counters(user.pk)[0]
+
+
+def _reconcile_batch(user_ids):
+    fields = list(SOURCES)
+    actual = actual_counters(user_ids)
+    stored = UserCounters.objects.in_bulk(user_ids)
+    missing = []
+    stale = []
+    for user_id, counters in actual.items():
+        current = stored.get(user_id)
+        if current is None:
+            missing.append(counters)
+        elif any(getattr(current, field) != getattr(counters, field)
+                 for field in fields):
+            stale.append(counters)
+    UserCounters.objects.bulk_create(missing)
+    UserCounters.objects.bulk_update(stale, fields)
+    return len(missing) + len(stale)
+
+
+def reconcile(user_ids=None, batch_size=1000):
+    """Сверяет счётчики с исходными таблицами и исправляет расхождения.
+    Возвращает число исправленных или созданных строк"""
+    if user_ids is None:
+        user_ids = User.objects.values_list("pk", flat=True).iterator()
+    fixed = 0
+    batch = []
+    for user_id in user_ids:
+        batch.append(user_id)
+        if len(batch) >= batch_size:
+            with transaction.atomic():
+                fixed += _reconcile_batch(batch)
+            batch = []
+    if batch:
+        with transaction.atomic():
+            fixed += _reconcile_batch(batch)
+    return fixed
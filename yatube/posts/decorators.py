@@ -0,0 +1,65 @@
+"""Кеширование целых страниц для анонимных посетителей.
+
+Анонимные посетители видят одинаковый HTML, поэтому готовый ответ
+хранится в кеше под ключом из пути, номера страницы и состояния
+данных страницы. Состояние же даёт ETag и Last-Modified, по которым
+браузеры и прокси перепроверяют страницу и получают 304"""
+import calendar
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+PAGE_CACHE_PREFIX = "anon-page:"
+
+
+def cache_page_for_anonymous(page_state):
+    """Кеширует ответ view для неавторизованных GET/HEAD-запросов.
+
+    page_state(request, *args, **kwargs) возвращает пару
+    (дата последнего изменения или None, строка версии данных страницы)
+    либо None, если объекта страницы нет — тогда ответ не кешируется"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ("GET", "HEAD")
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+            state = page_state(request, *args, **kwargs)
+            if state is None:
+                return view(request, *args, **kwargs)
+            last_modified, version = state
+            timestamp = (calendar.timegm(last_modified.utctimetuple())
+                         if last_modified else None)
+            signature = "|".join((request.path,
+                                  request.GET.get("page", ""),
+                                  request.GET.get("cursor", ""),
+                                  str(version), str(timestamp)))
+            etag = quote_etag(hashlib.md5(signature.encode()).hexdigest())
+
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=timestamp)
+            if not_modified is not None:
+                return not_modified
+
+            key = PAGE_CACHE_PREFIX + etag.strip('"')
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                response["ETag"] = etag
+                if timestamp is not None:
+                    response["Last-Modified"] = http_date(timestamp)
+                patch_cache_control(response, max_age=0)
+                cache.set(key, response,
+                          settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+            return response
+
+        return wrapper
+
+    return decorator
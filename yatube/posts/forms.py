@@ -2,6 +2,8 @@
  - создание поста и добавление комментария к посту.
 Поля форм взяты из соответствующих моделей файла models.py"""
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from .images import normalize_image
 from .models import Post, Comment
 from django.utils.translation import gettext_lazy as _
 
@@ -20,6 +22,14 @@ class PostForm(forms.ModelForm):
             raise forms.ValidationError("Поле 'Текст' должно быть заполнено")
         return data
 
+    def clean_image(self):
+        """Новая картинка уменьшается и очищается от EXIF до сохранения;
+        уже сохранённая при редактировании поста не трогается"""
+        image = self.cleaned_data["image"]
+        if isinstance(image, UploadedFile):
+            return normalize_image(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     """Настройки формы для комментариев на основе модели комментариев"""
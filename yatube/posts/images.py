@@ -0,0 +1,88 @@
+"""Нормализация загружаемых изображений постов.
+
+Картинка проверяется и перекодируется один раз при загрузке: снимается
+EXIF (с учётом ориентации), слишком большие снимки уменьшаются до
+POST_IMAGE_MAX_SIDE по большей стороне. Дальше sorl-thumbnail строит
+миниатюры уже из компактного файла, а не из оригинала с камеры"""
+import os
+import tempfile
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, ImageOps
+
+# Форматы, которые сохраняются как есть; остальные перекодируются в JPEG
+# (или в PNG, если у картинки есть прозрачность)
+KEPT_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+# Метаданные, которые не должны попасть в сохранённый файл
+# (в EXIF и XMP бывают координаты съёмки и данные камеры)
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "photoshop", "comment")
+
+
+def _needs_processing(image):
+    return (image.format not in KEPT_FORMATS
+            or max(image.size) > settings.POST_IMAGE_MAX_SIDE
+            or any(key in image.info for key in METADATA_KEYS)
+            or image.getexif())
+
+
+def _save_options(image_format):
+    if image_format == "JPEG":
+        return {"quality": settings.POST_IMAGE_JPEG_QUALITY,
+                "optimize": True, "progressive": True}
+    if image_format in ("PNG", "GIF"):
+        return {"optimize": True}
+    if image_format == "WEBP":
+        return {"quality": settings.POST_IMAGE_JPEG_QUALITY}
+    return {}
+
+
+def normalize_image(upload):
+    """Возвращает загруженный файл, готовый к сохранению.
+
+    Маленькие картинки без EXIF в поддерживаемом формате возвращаются
+    без изменений; анимированные — тоже, чтобы не потерять кадры"""
+    if upload.size > settings.POST_IMAGE_MAX_UPLOAD_SIZE:
+        raise forms.ValidationError(
+            "Файл слишком большой: не более %(limit)d МБ",
+            params={"limit": settings.POST_IMAGE_MAX_UPLOAD_SIZE // 2 ** 20},
+            code="file_too_large")
+    upload.seek(0)
+    # Image.open читает только заголовок: размер известен до декодирования
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise forms.ValidationError(
+            "Слишком большое разрешение: %(width)d×%(height)d",
+            params={"width": width, "height": height},
+            code="too_many_pixels")
+    if getattr(image, "is_animated", False) or not _needs_processing(image):
+        upload.seek(0)
+        return upload
+
+    image_format = image.format
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    # Для JPEG уменьшение в 2–8 раз делается прямо при декодировании
+    image.draft(image.mode, (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    for key in METADATA_KEYS:
+        image.info.pop(key, None)
+
+    if image_format not in KEPT_FORMATS:
+        has_alpha = image.mode in ("RGBA", "LA", "P")
+        image_format = "PNG" if has_alpha else "JPEG"
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    # Результат пишется в память, а большие файлы — во временный файл
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    image.save(output, image_format, **_save_options(image_format))
+    size = output.tell()
+    output.seek(0)
+    name = os.path.splitext(upload.name)[0] + KEPT_FORMATS[image_format]
+    return UploadedFile(output, name=name,
+                        content_type=Image.MIME[image_format], size=size)
@@ -0,0 +1,72 @@
+"""Замер времени выборки страниц лент на текущей базе.
+
+Для сравнения "до/после" индексов запустите команду дважды:
+после `migrate posts 0013` и после `migrate posts`"""
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from posts.models import Comment, Follow, Post, User
+from posts.paginators import KeysetPaginator
+from posts.timeline import timeline_posts
+
+
+class Command(BaseCommand):
+    help = "Измеряет время выборки страниц лент постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20,
+                            help="Сколько раз выполнять каждый запрос")
+        parser.add_argument("--deep-page", type=int, default=1000,
+                            help="Номер «глубокой» страницы для OFFSET")
+
+    def handle(self, *args, **options):
+        latest = Post.objects.exclude(group=None).first()
+        if latest is None:
+            self.stderr.write("В базе нет постов с группой")
+            return
+        reader = (Follow.objects.values("user").annotate(n=Count("id"))
+                  .order_by("-n").first())
+        busiest_post = (Comment.objects.values("post")
+                        .annotate(n=Count("id")).order_by("-n").first())
+        per_page = settings.POSTS_PER_PAGE
+        deep = (options["deep_page"] - 1) * per_page
+        deep_post = Post.objects.all()[deep:deep + 1].first()
+
+        scenarios = {
+            "index, стр. 1": lambda: list(Post.objects.all()[:per_page]),
+            "index, COUNT(*)": lambda: Post.objects.count(),
+            f"index, стр. {options['deep_page']} (OFFSET)":
+                lambda: list(Post.objects.all()[deep:deep + per_page]),
+            "профиль автора": lambda: list(
+                Post.objects.filter(author_id=latest.author_id)[:per_page]),
+            "группа": lambda: list(
+                Post.objects.filter(group_id=latest.group_id)[:per_page]),
+            "комментарии к посту": lambda: list(Comment.objects.filter(
+                post_id=busiest_post["post"] if busiest_post else 0)),
+        }
+        if deep_post is not None:
+            cursor = KeysetPaginator.encode_cursor(deep_post)
+            paginator = KeysetPaginator(Post.objects.all(), per_page)
+            scenarios[f"index, стр. {options['deep_page']} (cursor)"] = (
+                lambda: paginator.get_page(cursor))
+        if reader is not None:
+            user = User.objects.get(pk=reader["user"])
+            scenarios["лента подписок"] = lambda: list(
+                timeline_posts(user)[:per_page])
+
+        self.stdout.write(f"Постов в базе: {Post.objects.count()}")
+        for name, query in scenarios.items():
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                query()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+            self.stdout.write(
+                f"{name:<32} медиана {statistics.median(timings):8.2f} мс"
+                f"  p95 {p95:8.2f} мс")
@@ -0,0 +1,94 @@
+"""Замер декодирования и построения миниатюр до и после нормализации.
+
+sorl-thumbnail заново открывает исходник для каждого варианта, поэтому
+время "миниатюры" — это декодирование и уменьшение исходника для всех
+пар (размер, формат) из настроек. Без аргументов используется
+синтетический снимок 4032×3024 с EXIF, как с камеры телефона"""
+import statistics
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageOps
+
+from posts.images import normalize_image
+from posts.thumbnails import variants
+
+
+def camera_photo():
+    """JPEG 12 Мп: плавные градиенты с лёгким шумом сенсора и EXIF"""
+    size = (4032, 3024)
+    gradient = Image.linear_gradient("L").resize(size)
+    image = Image.merge("RGB", (
+        gradient, gradient.rotate(90).resize(size),
+        Image.radial_gradient("L").resize(size)))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    image = Image.blend(image, noise, 0.15)
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"
+    exif[0x0112] = 1
+    content = BytesIO()
+    image.save(content, "JPEG", quality=95, exif=exif.tobytes())
+    return content.getvalue()
+
+
+def decode(content):
+    image = Image.open(BytesIO(content))
+    image.load()
+    return image
+
+
+def build_variants(content):
+    for geometry, fmt in variants():
+        size = tuple(int(side) for side in geometry.split("x"))
+        image = ImageOps.fit(decode(content).convert("RGB"), size,
+                             Image.LANCZOS)
+        image.save(BytesIO(), fmt)
+
+
+class Command(BaseCommand):
+    help = "Сравнивает стоимость миниатюр до и после нормализации загрузки"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*",
+                            help="Картинки для замера (по умолчанию — "
+                                 "синтетический снимок с камеры)")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def measure(self, func, content):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            func(content)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        sources = {}
+        for path in options["paths"]:
+            with open(path, "rb") as source:
+                sources[path] = source.read()
+        if not sources:
+            sources["снимок 4032×3024"] = camera_photo()
+
+        for name, original in sources.items():
+            upload = SimpleUploadedFile(name, original)
+            started = time.perf_counter()
+            normalized = normalize_image(upload)
+            normalize_ms = (time.perf_counter() - started) * 1000
+            normalized.seek(0)
+            normalized = normalized.read()
+
+            self.stdout.write(
+                f"{name}: нормализация {normalize_ms:.0f} мс (один раз)")
+            for label, content in (("до", original),
+                                   ("после", normalized)):
+                image = decode(content)
+                self.stdout.write(
+                    f"  {label:<6} {image.size[0]}×{image.size[1]} "
+                    f"{len(content) / 1024:8.0f} КБ  "
+                    f"декодирование {self.measure(decode, content):7.1f} мс"
+                    f"  все миниатюры "
+                    f"{self.measure(build_variants, content):7.1f} мс")
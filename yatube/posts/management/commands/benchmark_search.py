@@ -0,0 +1,70 @@
+"""Замер поиска по индексу FTS5 против сканирования LIKE '%...%'.
+
+Для каждого запроса измеряются число найденных постов (COUNT для
+пагинатора) и первая страница выдачи — то, что делает страница поиска.
+Без аргументов запросы составляются из слов случайных постов базы"""
+import random
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.search import LikeSearchBackend, SQLiteFTSBackend
+
+
+def sample_queries(count):
+    texts = Post.objects.order_by("?").values_list("text", flat=True)
+    queries = []
+    for text in texts[:count * 5]:
+        words = [word for word in re.findall(r"\w+", text) if len(word) > 3]
+        if words:
+            queries.append(" ".join(random.sample(words,
+                                                  min(2, len(words)))))
+        if len(queries) == count:
+            break
+    return queries
+
+
+class Command(BaseCommand):
+    help = "Сравнивает поиск по индексу FTS5 и сканирование LIKE"
+
+    def add_arguments(self, parser):
+        parser.add_argument("queries", nargs="*",
+                            help="Поисковые запросы (по умолчанию — слова "
+                                 "из случайных постов)")
+        parser.add_argument("--repeat", type=int, default=10,
+                            help="Сколько раз выполнять каждый запрос")
+        parser.add_argument("--sample", type=int, default=5,
+                            help="Сколько запросов составить из базы")
+
+    def measure(self, backend, query):
+        per_page = settings.POSTS_PER_PAGE
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            found = backend.count(query)
+            backend.ranked_ids(query, 0, per_page)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        return found, statistics.median(timings), p95
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        queries = options["queries"] or sample_queries(options["sample"])
+        if not queries:
+            self.stderr.write("В базе нет постов для составления запросов")
+            return
+        backends = {"FTS5": SQLiteFTSBackend(), "LIKE": LikeSearchBackend()}
+
+        self.stdout.write(f"Постов в базе: {Post.objects.count()}")
+        for query in queries:
+            self.stdout.write(f"«{query}»")
+            for name, backend in backends.items():
+                found, median, p95 = self.measure(backend, query)
+                self.stdout.write(
+                    f"  {name:<5} найдено {found:>7}  медиана "
+                    f"{median:8.2f} мс  p95 {p95:8.2f} мс")
@@ -0,0 +1,213 @@
+"""Нагрузочный замер всех URL приложения posts.
+
+Каждый именованный URL из posts/urls.py запрашивается тестовым клиентом
+Django (весь стек middleware, без сети) на текущей базе — удобно после
+seed_data. Для каждого URL считаются p50/p95/p99 времени ответа и число
+SQL-запросов. Запрос выполняется в транзакции, которая откатывается,
+поэтому комментарии и подписки из замера не остаются в базе.
+
+Результаты сохраняются в JSON; с --baseline прогон сравнивается
+с сохранённым, и при регрессии команда завершается с ошибкой"""
+import json
+import math
+import os
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import urls
+from posts.models import Comment, Follow, Post, User, UserCounters
+from posts.search import get_backend
+
+
+def percentile(timings, share):
+    """Значение по рангу (nearest-rank) в отсортированном списке"""
+    return timings[max(0, math.ceil(share * len(timings)) - 1)]
+
+
+def sample_requests():
+    """Запросы для каждого URL: name -> (метод, kwargs, параметры,
+    пользователь). Берутся самые нагруженные объекты базы: читатель
+    с наибольшим числом подписок, самый популярный автор, самый
+    обсуждаемый пост"""
+    reader_id = (Follow.objects.values("user").annotate(n=Count("id"))
+                 .order_by("-n").values_list("user", flat=True).first())
+    reader = User.objects.filter(pk=reader_id).first() or User.objects.first()
+    author = User.objects.filter(pk=UserCounters.objects.order_by(
+        "-follower_count").values_list("user_id", flat=True).first()
+    ).first() or reader
+    post = Post.objects.select_related("author").order_by(
+        "-comment_count").first()
+    group_post = Post.objects.exclude(group=None).select_related(
+        "group").first()
+    followed = (Follow.objects.filter(user=reader).select_related("author")
+                .first() if reader else None)
+    if reader is None or post is None:
+        raise CommandError("В базе нет данных: запустите seed_data")
+
+    word = (post.text.split() or ["пост"])[0].strip(".,")
+    requests = {
+        "index": ("get", {}, {}, reader),
+        "new_post": ("get", {}, {}, reader),
+        "follow_index": ("get", {}, {}, reader),
+        "search": ("get", {}, {"q": word}, reader),
+        "profile": ("get", {"username": author.username}, {}, reader),
+        "post": ("get", {"username": post.author.username,
+                         "post_id": post.id}, {}, reader),
+        "post_edit": ("get", {"username": post.author.username,
+                              "post_id": post.id}, {}, post.author),
+        "add_comment": ("post", {"username": post.author.username,
+                                 "post_id": post.id},
+                        {"text": "Замер"}, reader),
+        "profile_follow": ("get", {"username": author.username}, {},
+                           reader),
+    }
+    if group_post is not None:
+        requests["group_posts"] = ("get", {"slug": group_post.group.slug},
+                                   {}, reader)
+    if followed is not None:
+        requests["profile_unfollow"] = (
+            "get", {"username": followed.author.username}, {}, reader)
+    return requests
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Измеряет p50/p95/p99 и число SQL-запросов для каждого URL "
+            "из posts/urls.py и сравнивает с сохранённым прогоном")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50,
+                            help="Сколько раз запрашивать каждый URL")
+        parser.add_argument("--warmup", type=int, default=3,
+                            help="Запросы перед замером (прогрев кешей)")
+        parser.add_argument("--anonymous", action="store_true",
+                            help="Открытые страницы запрашивать без входа")
+        parser.add_argument("--output",
+                            help="Файл для результатов (по умолчанию "
+                                 "benchmarks/<дата>-<коммит>.json)")
+        parser.add_argument("--baseline",
+                            help="Прогон, с которым сравнить результаты")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Допустимый рост p95, доля (0.2 = 20%%)")
+
+    def handle(self, *args, **options):
+        requests = sample_requests()
+        clients = {}
+        results = {}
+        for pattern in urls.urlpatterns:
+            name = pattern.name
+            if name not in requests:
+                self.stderr.write(f"{name}: нет образца запроса, пропущен")
+                continue
+            method, kwargs, params, user = requests[name]
+            if options["anonymous"] and name in ("index", "group_posts",
+                                                 "search", "profile",
+                                                 "post"):
+                user = None
+            if user not in clients:
+                clients[user] = Client()
+                if user is not None:
+                    clients[user].force_login(user)
+            url = reverse(name, kwargs=kwargs)
+            results[name] = self.measure(
+                getattr(clients[user], method), url, params,
+                options["repeat"], options["warmup"])
+            results[name]["url"] = url
+            self.report(name, results[name])
+
+        run = {
+            "created": timezone.now().isoformat(),
+            "revision": git_revision(),
+            "repeat": options["repeat"],
+            "anonymous": options["anonymous"],
+            "settings": {
+                "POSTS_PAGINATION": settings.POSTS_PAGINATION,
+                "THUMBNAIL_PIPELINE": settings.THUMBNAIL_PIPELINE,
+                "POST_SEARCH_BACKEND": type(get_backend()).__name__,
+            },
+            "dataset": {model.__name__: model.objects.count()
+                        for model in (User, Post, Comment, Follow)},
+            "results": results,
+        }
+        path = options["output"] or os.path.join(
+            settings.BASE_DIR, "benchmarks",
+            f"{timezone.now():%Y%m%d-%H%M%S}-{run['revision'] or 'local'}"
+            f".json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as output:
+            json.dump(run, output, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Результаты сохранены в {path}")
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["threshold"])
+
+    def measure(self, request, url, params, repeat, warmup):
+        timings = []
+        queries = []
+        status = None
+        for attempt in range(warmup + repeat):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = request(url, params)
+                    elapsed = (time.perf_counter() - started) * 1000
+                transaction.set_rollback(True)
+            if attempt >= warmup:
+                timings.append(elapsed)
+                queries.append(len(captured))
+                status = response.status_code
+        timings.sort()
+        return {"status": status,
+                "p50": round(statistics.median(timings), 3),
+                "p95": round(percentile(timings, 0.95), 3),
+                "p99": round(percentile(timings, 0.99), 3),
+                "queries": max(queries)}
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<18} {result['status']}  p50 {result['p50']:8.2f} мс"
+            f"  p95 {result['p95']:8.2f} мс  p99 {result['p99']:8.2f} мс"
+            f"  запросов {result['queries']:3}")
+
+    def compare(self, results, baseline_path, threshold):
+        """Регрессия — рост числа запросов или p95 больше чем на
+        threshold (и больше чем на 1 мс, чтобы не ловить шум)"""
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = []
+        self.stdout.write(f"Сравнение с {baseline_path}:")
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            change = result["p95"] / before["p95"] - 1 if before["p95"] else 0
+            self.stdout.write(
+                f"{name:<18} p95 {before['p95']:8.2f} -> {result['p95']:8.2f}"
+                f" мс ({change:+.0%})  запросов {before['queries']} -> "
+                f"{result['queries']}")
+            if result["queries"] > before["queries"]:
+                regressions.append(f"{name}: запросов {before['queries']} "
+                                   f"-> {result['queries']}")
+            elif (change > threshold
+                    and result["p95"] - before["p95"] > 1):
+                regressions.append(f"{name}: p95 {change:+.0%}")
+        if regressions:
+            raise CommandError("Регрессии: " + "; ".join(regressions))
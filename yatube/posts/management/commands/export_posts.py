@@ -0,0 +1,85 @@
+"""Потоковая выгрузка снимка базы в NDJSON.
+
+Каждая строка файла — один объект в формате dumpdata
+({"model": ..., "pk": ..., "fields": {...}}), таблицы идут в порядке
+SNAPSHOT_MODELS. Строки читаются из базы порциями, поэтому память
+не растёт с размером базы, в отличие от dumpdata. Файлы изображений
+в снимок не входят, каталог MEDIA_ROOT переносится отдельно"""
+import datetime
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from posts.bulk import SNAPSHOT_MODELS, open_snapshot
+
+
+class SnapshotEncoder(DjangoJSONEncoder):
+    """Даты с микросекундами: DjangoJSONEncoder обрезает их
+    до миллисекунд, и после загрузки снимка время сдвигалось бы"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class Command(BaseCommand):
+    help = ("Выгружает пользователей, группы, посты, комментарии и подписки "
+            "в NDJSON (по объекту на строку) с ограниченным расходом памяти")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path",
+                            help="Файл снимка (.gz — со сжатием, "
+                                 "«-» — стандартный вывод)")
+        parser.add_argument("--batch-size", type=int, default=2000,
+                            help="Сколько строк читать из базы за раз")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        # Если снимок идёт в стандартный вывод, отчёт пишется в stderr
+        report = self.stderr if path == "-" else self.stdout
+        started = time.perf_counter()
+        total = 0
+        output = open_snapshot(path, "w")
+        try:
+            # Одна транзакция — согласованный снимок всех таблиц
+            with transaction.atomic():
+                for model in SNAPSHOT_MODELS:
+                    total += self.export(model, output, options["batch_size"],
+                                         report)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        elapsed = time.perf_counter() - started
+        report.write(self.style.SUCCESS(
+            f"Выгружено строк: {total} за {elapsed:.1f} с "
+            f"({total / max(elapsed, 1e-9):.0f} строк/с)"))
+
+    def export(self, model, output, batch_size, report):
+        started = time.perf_counter()
+        label = model._meta.label_lower
+        # Только собственные столбцы таблицы: связи многие-ко-многим
+        # (группы и права пользователей) стоили бы запроса на объект.
+        # Строки читаются без создания моделей: объект в формате
+        # dumpdata собирается прямо из значений столбцов
+        fields = [field for field in model._meta.concrete_fields
+                  if not field.primary_key]
+        rows = model._default_manager.order_by("pk").values_list(
+            model._meta.pk.attname, *(field.attname for field in fields))
+        count = 0
+        for pk, *values in rows.iterator(chunk_size=batch_size):
+            record = {"model": label, "pk": pk,
+                      "fields": {field.name: value
+                                 for field, value in zip(fields, values)}}
+            output.write(json.dumps(record, cls=SnapshotEncoder,
+                                    ensure_ascii=False))
+            output.write("\n")
+            count += 1
+        elapsed = time.perf_counter() - started
+        report.write(f"{label}: {count} за {elapsed:.1f} с "
+                     f"({count / max(elapsed, 1e-9):.0f} строк/с)")
+        return count
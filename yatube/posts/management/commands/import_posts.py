@@ -0,0 +1,116 @@
+"""Потоковая загрузка снимка, выгруженного export_posts.
+
+Файл читается построчно, объекты вставляются через bulk_create
+порциями, каждая порция — в своей транзакции: память не зависит
+от размера снимка, а оборванную загрузку можно продолжить
+с --ignore-conflicts. Производные данные (счётчики, ленты подписок,
+поисковый индекс) после загрузки строятся заново"""
+import json
+import sys
+import time
+
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+
+from posts.bulk import (SNAPSHOT_MODELS, auto_dated_fields, explicit_dates,
+                        open_snapshot)
+
+
+class Command(BaseCommand):
+    help = ("Загружает снимок NDJSON из export_posts порциями bulk_create "
+            "с ограниченным расходом памяти")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path",
+                            help="Файл снимка (.gz — со сжатием, "
+                                 "«-» — стандартный ввод)")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Строк в одной транзакции")
+        parser.add_argument("--ignore-conflicts", action="store_true",
+                            help="Пропускать строки, которые уже есть "
+                                 "в базе (продолжение загрузки)")
+        parser.add_argument("--skip-rebuild", action="store_true",
+                            help="Не пересобирать счётчики, ленты "
+                                 "и поисковый индекс")
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.ignore_conflicts = options["ignore_conflicts"]
+        self.labels = {model._meta.label_lower for model in SNAPSHOT_MODELS}
+        self.line = 0
+        self.totals = {}
+        self.batch = []
+        started = time.perf_counter()
+        stream = open_snapshot(options["path"], "r")
+        try:
+            objects = serializers.deserialize(
+                "python", self.records(stream), ignorenonexistent=True)
+            for deserialized in objects:
+                obj = deserialized.object
+                if self.batch and type(obj) is not type(self.batch[0]):
+                    self.flush()
+                self.batch.append(obj)
+                if len(self.batch) >= self.batch_size:
+                    self.flush()
+            self.flush()
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # Вставка с явными id не сдвигает последовательности PostgreSQL
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), SNAPSHOT_MODELS):
+                cursor.execute(sql)
+
+        elapsed = time.perf_counter() - started
+        total = 0
+        for label, (count, seconds) in self.totals.items():
+            total += count
+            self.stdout.write(f"{label}: {count} за {seconds:.1f} с "
+                              f"({count / max(seconds, 1e-9):.0f} строк/с)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено строк: {total} за {elapsed:.1f} с "
+            f"({total / max(elapsed, 1e-9):.0f} строк/с)"))
+
+        if not options["skip_rebuild"]:
+            for command in ("reconcile_counters", "rebuild_timelines",
+                            "rebuild_search_index"):
+                call_command(command, stdout=self.stdout)
+
+    def records(self, stream):
+        for self.line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as error:
+                raise CommandError(f"Строка {self.line}: {error}")
+            if record.get("model") not in self.labels:
+                raise CommandError(
+                    f"Строка {self.line}: модель {record.get('model')} "
+                    f"не входит в снимок")
+            yield record
+
+    def flush(self):
+        if not self.batch:
+            return
+        model = type(self.batch[0])
+        started = time.perf_counter()
+        try:
+            with transaction.atomic(), \
+                    explicit_dates(*auto_dated_fields(model)):
+                model.objects.bulk_create(
+                    self.batch, ignore_conflicts=self.ignore_conflicts)
+        except DatabaseError as error:
+            raise CommandError(
+                f"Порция до строки {self.line} ({model._meta.label_lower}) "
+                f"не загружена: {error}")
+        label = model._meta.label_lower
+        count, seconds = self.totals.get(label, (0, 0))
+        self.totals[label] = (count + len(self.batch),
+                              seconds + time.perf_counter() - started)
+        self.batch = []
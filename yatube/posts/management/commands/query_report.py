@@ -0,0 +1,82 @@
+"""Сводка находок детектора SQL-запросов (yatube/query_inspector.py)"""
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+KIND_TITLES = {
+    "duplicate": "Повтор",
+    "similar": "Однотипные",
+    "slow": "Медленный",
+}
+
+
+def shorten(sql, limit=300):
+    """Длинный SQL без середины: обычно это список столбцов,
+    а таблица и условия — в начале и в конце"""
+    if len(sql) <= limit:
+        return sql
+    return f"{sql[:limit // 2]} … {sql[-limit // 2:]}"
+
+
+def read_findings(path, kind=None):
+    """Находки из отчёта, сгруппированные по (вид, URL, SQL)"""
+    groups = defaultdict(lambda: {"responses": 0, "count": 0,
+                                  "time_ms": 0.0, "stacks": []})
+    with open(path, encoding="utf-8") as report:
+        for line in report:
+            entry = json.loads(line)
+            for finding in entry["findings"]:
+                if kind not in (None, finding["kind"]):
+                    continue
+                group = groups[finding["kind"], entry["route"],
+                               finding["sql"]]
+                group.setdefault("params", finding["params"])
+                group["responses"] += 1
+                group["count"] += finding["count"]
+                group["time_ms"] += finding["time_ms"]
+                for stack in finding["stacks"]:
+                    if stack not in group["stacks"]:
+                        group["stacks"].append(stack)
+    return groups
+
+
+class Command(BaseCommand):
+    help = ("Сводит отчёт детектора лишних SQL-запросов: повторы, "
+            "однотипные и медленные запросы по URL и месту в коде")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?",
+                            help="Файл отчёта (по умолчанию "
+                                 "QUERY_REPORT_FILE)")
+        parser.add_argument("--kind", choices=sorted(KIND_TITLES))
+        parser.add_argument("--top", type=int, default=20)
+
+    def handle(self, *args, **options):
+        path = options["path"] or settings.QUERY_REPORT_FILE
+        try:
+            groups = read_findings(path, options["kind"])
+        except FileNotFoundError:
+            raise CommandError(f"Отчёта {path} нет: запустите сайт "
+                               f"с QUERY_INSPECTOR=1")
+
+        # Сначала то, что стоило базе больше всего времени
+        ranked = sorted(groups.items(), key=lambda item: -item[1]["time_ms"])
+        for (kind, route, sql), group in ranked[:options["top"]]:
+            self.write_group(kind, route, sql, group)
+        if not groups:
+            self.stdout.write(self.style.SUCCESS("Лишних запросов нет"))
+
+    def write_group(self, kind, route, sql, group):
+        self.stdout.write(self.style.WARNING(
+            f"{KIND_TITLES[kind]} в {route}: {group['count']} запросов "
+            f"в {group['responses']} ответах, "
+            f"{group['time_ms']:.1f} мс"))
+        self.stdout.write(f"  {shorten(sql)}")
+        self.stdout.write(f"  Параметры: {group['params']}")
+        for stack in group["stacks"][:3]:
+            self.stdout.write("  Стек:")
+            for path, lineno, function, code in stack:
+                self.stdout.write(f"    {path}:{lineno} в {function}: "
+                                  f"{code}")
@@ -0,0 +1,16 @@
+"""Пересборка поискового индекса постов"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.search import get_backend
+
+
+class Command(BaseCommand):
+    help = ("Строит поисковый индекс заново по всем постам (после "
+            "bulk_create, QuerySet.update и загрузки дампов)")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Постов в индексе: {indexed}"))
@@ -0,0 +1,22 @@
+"""Пересборка материализованных лент подписок"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленты подписок по текущим подпискам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", dest="user_ids", type=int, action="append",
+            help="id пользователя, чью ленту нужно пересобрать "
+                 "(можно указать несколько раз; по умолчанию — все)",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = rebuild_timelines(options["user_ids"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Записей в лентах: {created}"))
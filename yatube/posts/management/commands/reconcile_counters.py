@@ -0,0 +1,21 @@
+"""Сверка денормализованных счётчиков пользователей"""
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики пользователей по исходным таблицам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", dest="user_ids", type=int, action="append",
+            help="id пользователя для сверки "
+                 "(можно указать несколько раз; по умолчанию — все)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = reconcile(options["user_ids"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Исправлено строк счётчиков: {fixed}"))
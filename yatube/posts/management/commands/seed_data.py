@@ -0,0 +1,233 @@
+"""Генерация набора данных production-масштаба для нагрузочных замеров.
+
+Пользователи, группы, подписки, посты и комментарии вставляются пачками
+через bulk_create, без сигналов; производные данные (счётчики, ленты
+подписок, поисковый индекс, статистика планировщика) затем строятся
+штатными командами. Популярность авторов и активность пользователей
+подчиняются степенному закону: немногие авторы собирают большую часть
+подписчиков, немногие пользователи пишут большую часть постов
+и комментариев, популярные посты получают больше комментариев"""
+import itertools
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from posts.bulk import chunked, explicit_dates
+from posts.models import Comment, Follow, Group, Post, User
+
+WORDS = (
+    "время человек год дело жизнь день рука работа слово место лицо друг "
+    "глаз вопрос дом сторона страна мир случай голова ребенок сила конец "
+    "вид система часть город отношение женщина деньги земля машина вода "
+    "отец проблема час право нога решение дверь образ история власть закон "
+    "война бог голос тысяча книга возможность результат ночь стол имя "
+    "область статья число компания народ жена группа развитие процесс суд "
+    "условие средство начало свет пора путь душа уровень форма связь "
+    "минута улица вечер качество мысль дорога мать действие месяц "
+    "государство язык любовь взгляд мама век школа цель общество "
+    "деятельность организация президент комната порядок момент театр "
+    "письмо утро помощь ситуация роль рубль смысл состояние квартира "
+    "орган внимание тело труд сын мера смерть рынок программа задача "
+    "предприятие окно разговор правительство семья производство "
+    "информация положение центр ответ муж автор стена интерес федерация "
+    "правило управление мужчина идея партия песня дорогой новый хороший "
+    "первый последний долгий большой высокий старый настоящий главный "
+    "ёлка лес река море поле небо солнце снег дождь ветер"
+).split()
+
+
+def cumulative_weights(count, exponent):
+    """Накопленные веса закона Ципфа: у ранга r вес 1 / r ** exponent"""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу правдоподобными данными: пользователи, группы, "
+            "подписки по степенному закону, посты и комментарии")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--groups", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=500000)
+        parser.add_argument("--comments", type=int, default=1000000)
+        parser.add_argument("--follows", type=int, default=20,
+                            help="Среднее число подписок пользователя")
+        parser.add_argument("--days", type=int, default=365,
+                            help="За сколько дней распределены посты")
+        parser.add_argument("--exponent", type=float, default=1.1,
+                            help="Показатель степенного закона популярности")
+        parser.add_argument("--prefix", default="seed",
+                            help="Префикс имён пользователей и групп")
+        parser.add_argument("--seed", type=int, default=None,
+                            help="Зерно генератора для повторяемых данных")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Пользователи с префиксом «{prefix}» уже есть, "
+                f"задайте другой --prefix")
+
+        self.user_ids = self.create_users(prefix, options["users"])
+        self.group_ids = self.create_groups(prefix, options["groups"])
+        # Ранг пользователя в списке — его популярность: первые
+        # получают больше подписчиков. Активность распределена так же,
+        # но по другому порядку пользователей: если самые читаемые
+        # авторы ещё и пишут больше всех, ленты подписок вырастают
+        # на порядки больше, чем в жизни
+        self.popularity = cumulative_weights(len(self.user_ids),
+                                             options["exponent"])
+        self.writers = self.random.sample(self.user_ids, len(self.user_ids))
+        self.activity = cumulative_weights(len(self.writers),
+                                           options["exponent"] * 0.8)
+        self.insert(Follow, self.follows(options["follows"]), "подписки")
+
+        now = timezone.now()
+        self.first_date = now - timedelta(days=options["days"])
+        self.step = (now - self.first_date) / max(options["posts"], 1)
+        first_post_id = (Post.objects.aggregate(
+            last=models.Max("id"))["last"] or 0) + 1
+        with explicit_dates(Post._meta.get_field("pub_date")):
+            self.insert(Post, self.posts(options["posts"]), "посты")
+        post_ids = list(Post.objects.filter(
+            id__gte=first_post_id).order_by("id").values_list(
+            "id", flat=True))
+        with explicit_dates(Comment._meta.get_field("created")):
+            self.insert(Comment, self.comments(post_ids, options["comments"],
+                                               options["exponent"], now),
+                        "комментарии")
+
+        self.step_timed("счётчики комментариев постов",
+                        self.fill_comment_counts, first_post_id)
+        self.step_timed("счётчики пользователей", call_command,
+                        "reconcile_counters", stdout=self.stdout)
+        self.step_timed("ленты подписок", call_command,
+                        "rebuild_timelines", stdout=self.stdout)
+        self.step_timed("поисковый индекс", call_command,
+                        "rebuild_search_index", stdout=self.stdout)
+        # Без свежей статистики планировщик SQLite считает таблицы
+        # пустыми и выбирает полный перебор вместо поиска по индексу
+        self.step_timed("статистика планировщика", self.analyze)
+
+    def insert(self, model, objects, label):
+        started = time.perf_counter()
+        total = 0
+        for chunk in chunked(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(chunk)
+            total += len(chunk)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label}: {total} за {elapsed:.1f} с "
+                          f"({total / max(elapsed, 1e-9):.0f} строк/с)")
+        return total
+
+    def step_timed(self, label, func, *args, **kwargs):
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        self.stdout.write(
+            f"{label}: {time.perf_counter() - started:.1f} с")
+
+    def create_users(self, prefix, count):
+        password = make_password(None)
+        digits = len(str(count))
+        self.insert(User, (User(username=f"{prefix}{i:0{digits}d}",
+                                password=password)
+                           for i in range(count)), "пользователи")
+        return list(User.objects.filter(username__startswith=prefix)
+                    .order_by("id").values_list("id", flat=True))
+
+    def create_groups(self, prefix, count):
+        self.insert(Group, (Group(title=f"Группа {i}",
+                                  slug=f"{prefix}-group-{i}",
+                                  description=self.text(5, 30)[:200])
+                            for i in range(count)), "группы")
+        return list(Group.objects.filter(slug__startswith=f"{prefix}-group-")
+                    .order_by("id").values_list("id", flat=True))
+
+    def text(self, low, high):
+        length = self.random.randint(low, high)
+        words = self.random.choices(WORDS, k=length)
+        return " ".join(words).capitalize() + "."
+
+    def follows(self, mean):
+        """Число подписок пользователя распределено логнормально,
+        авторы выбираются пропорционально популярности"""
+        users = self.user_ids
+        if len(users) < 2:
+            return
+        sigma = 1.0
+        mu = math.log(max(mean, 1)) - sigma ** 2 / 2
+        for user_id in users:
+            wanted = min(int(self.random.lognormvariate(mu, sigma)),
+                         len(users) - 1)
+            authors = set()
+            for _ in range(3):
+                authors.update(self.random.choices(
+                    users, cum_weights=self.popularity, k=wanted))
+                authors.discard(user_id)
+                if len(authors) >= wanted:
+                    break
+            for author_id in itertools.islice(authors, wanted):
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    def posts(self, count):
+        """Посты идут по времени равномерно, с id в том же порядке;
+        у 60% постов есть группа, популярные группы крупнее"""
+        group_weights = cumulative_weights(len(self.group_ids), 1.0)
+        for i in range(count):
+            group_id = None
+            if self.group_ids and self.random.random() < 0.6:
+                group_id = self.random.choices(
+                    self.group_ids, cum_weights=group_weights)[0]
+            author_id = self.random.choices(
+                self.writers, cum_weights=self.activity)[0]
+            length = min(int(self.random.lognormvariate(3, 0.8)) + 3, 300)
+            yield Post(text=self.text(length, length), author_id=author_id,
+                       group_id=group_id, pub_date=self.post_date(i))
+
+    def post_date(self, index):
+        return self.first_date + self.step * index
+
+    def comments(self, post_ids, count, exponent, now):
+        """Популярность постов тоже степенная: большинство постов
+        без комментариев, у немногих — длинные обсуждения"""
+        if not post_ids:
+            return
+        ranks = list(range(len(post_ids)))
+        self.random.shuffle(ranks)
+        weights = cumulative_weights(len(post_ids), exponent)
+        for _ in range(count):
+            index = ranks[self.random.choices(
+                range(len(ranks)), cum_weights=weights)[0]]
+            delay = timedelta(seconds=self.random.expovariate(1 / 3600))
+            yield Comment(
+                text=self.text(2, 40), post_id=post_ids[index],
+                author_id=self.random.choices(
+                    self.writers, cum_weights=self.activity)[0],
+                created=min(self.post_date(index) + delay, now))
+
+    def fill_comment_counts(self, first_post_id):
+        totals = (Comment.objects.filter(post=OuterRef("pk")).order_by()
+                  .values("post").annotate(total=Count("pk"))
+                  .values("total"))
+        with transaction.atomic():
+            Post.objects.filter(id__gte=first_post_id).update(
+                comment_count=Coalesce(
+                    Subquery(totals, output_field=models.IntegerField()), 0))
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
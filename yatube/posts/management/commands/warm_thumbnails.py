@@ -0,0 +1,102 @@
+"""Прогрев миниатюр всех изображений постов перед переключением трафика.
+
+Картинки раздаются пулу процессов. Уже построенные миниатюры находятся
+в KV-хранилище sorl-thumbnail и пропускаются, поэтому прерванный прогрев
+продолжается повторным запуском с того же места. Ленты с постами
+построенных картинок сбрасываются пачками по REFRESH_BATCH картинок:
+в закешированных фрагментах до прогрева стоят заглушки"""
+import multiprocessing
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.models import Post
+from posts.thumbnails import (generate_thumbnails, missing_thumbnails,
+                              refresh_pages)
+
+BUILT, SKIPPED, FAILED = "built", "skipped", "failed"
+REFRESH_BATCH = 500
+
+
+def warm_image(name, force=False):
+    """Строит недостающие миниатюры одной картинки, возвращает итог"""
+    image = Post(image=name).image
+    if force:
+        default.kvstore.delete_thumbnails(ImageFile(image))
+        missing = None
+    else:
+        missing = missing_thumbnails(image)
+        if not missing:
+            return SKIPPED
+    return BUILT if generate_thumbnails(image, missing) else FAILED
+
+
+def _warm(name):
+    return name, warm_image(name)
+
+
+def _warm_forced(name):
+    return name, warm_image(name, force=True)
+
+
+class Command(BaseCommand):
+    help = "Строит миниатюры всех изображений постов в пуле процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes", type=int, default=multiprocessing.cpu_count(),
+            help="Число процессов (0 — в текущем процессе)")
+        parser.add_argument(
+            "--chunk-size", type=int,
+            help="Сколько картинок выдавать процессу за раз "
+                 "(по умолчанию — по числу картинок, не больше 16)")
+        parser.add_argument("--force", action="store_true",
+                            help="Перестроить и уже готовые миниатюры")
+        parser.add_argument("--progress-every", type=int, default=100,
+                            help="Выводить прогресс каждые N картинок")
+
+    def handle(self, *args, **options):
+        names = list(Post.objects.exclude(image="").exclude(image=None)
+                     .order_by().values_list("image", flat=True).distinct())
+        total = len(names)
+        self.stdout.write(f"Изображений: {total}")
+        worker = _warm_forced if options["force"] else _warm
+        results = {BUILT: 0, SKIPPED: 0, FAILED: 0}
+        built = []
+        started = time.perf_counter()
+
+        if options["processes"] > 0:
+            # Соединения с базой не должны наследоваться дочерними
+            # процессами — каждый откроет своё
+            connections.close_all()
+            pool = multiprocessing.Pool(options["processes"])
+            chunk_size = options["chunk_size"] or max(
+                1, min(16, total // (options["processes"] * 4)))
+        else:
+            pool = None
+
+        with pool or nullcontext():
+            outcomes = (pool.imap_unordered(worker, names, chunk_size)
+                        if pool else map(worker, names))
+            for done, (name, outcome) in enumerate(outcomes, 1):
+                results[outcome] += 1
+                if outcome == BUILT:
+                    built.append(name)
+                if built and (len(built) >= REFRESH_BATCH or done == total):
+                    refresh_pages(built)
+                    built = []
+                if done % options["progress_every"] == 0 or done == total:
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{done}/{total}  {done / elapsed:.1f} изобр./с")
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Построено: {results[BUILT]}, пропущено: {results[SKIPPED]}, "
+            f"ошибок: {results[FAILED]} за {elapsed:.1f} с "
+            f"({rate:.1f} изобр./с)"))
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-18 01:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    sources = {
+        'post_count': (apps.get_model('posts', 'Post'), 'author'),
+        'follower_count': (apps.get_model('posts', 'Follow'), 'author'),
+        'following_count': (apps.get_model('posts', 'Follow'), 'user'),
+        'comment_count': (apps.get_model('posts', 'Comment'), 'author'),
+    }
+    counters = {pk: UserCounters(user_id=pk)
+                for pk in User.objects.values_list('pk', flat=True)}
+    for field, (model, user_field) in sources.items():
+        totals = (model.objects.order_by().values(user_field)
+                  .annotate(total=Count('pk')).values_list(user_field, 'total'))
+        for user_id, total in totals:
+            setattr(counters[user_id], field, total)
+    UserCounters.objects.bulk_create(counters.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0014_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounters',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('post_count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('follower_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписок')),
+                ('comment_count', models.PositiveIntegerField(default=0, verbose_name='Комментариев')),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -32,15 +34,32 @@ class Post(models.Model):
     )
     image = models.ImageField(
         upload_to="posts/",
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True,
+        db_index=True,
         help_text="Добавьте картинку к записи"
     )
+    comment_count = models.PositiveIntegerField(
+        "Комментариев",
+        default=0,
+        editable=False,
+        help_text="Обновляется автоматически"
+    )
 
     class Meta:
-        """Сортировка вывода постов на страницах по дате"""
+        """Сортировка вывода постов на страницах по дате.
+        Индексы повторяют порядок лент: общей, автора и группы"""
 
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"],
+                         name="post_pub_date_idx"),
+            models.Index(fields=["author", "-pub_date"],
+                         name="post_author_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date"],
+                         name="post_group_pub_date_idx"),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -90,6 +109,9 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ["created"]
+        indexes = [models.Index(fields=["post", "created"],
+                                name="comment_post_created_idx")
+                   ]
 
     def __str__(self):
         return self.text[:15]
@@ -115,3 +137,61 @@ class Follow(models.Model):
         constraints = [models.UniqueConstraint(fields=["user", "author"],
                        name="unique_subscribing",)
                        ]
+        # (user, author) покрыт уникальным ограничением,
+        # обратный индекс нужен для выборки подписчиков автора
+        indexes = [models.Index(fields=["author", "user"],
+                                name="follow_author_user_idx")
+                   ]
+
+
+class FeedEntry(models.Model):
+    """Материализованная лента подписок: пост автора, на которого
+    подписан пользователь. Заполняется при публикации поста
+    (fan-out on write), поэтому лента читается одним диапазоном
+    по индексу (user, -pub_date)"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Читатель ленты",
+        related_name="feed_entries",
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name="Запись",
+        related_name="feed_entries",
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Автор записи",
+        related_name="+",
+    )
+    pub_date = models.DateTimeField("Дата публикации")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "post"],
+                       name="unique_feed_entry",)
+                       ]
+        indexes = [models.Index(fields=["user", "-pub_date"],
+                                name="feed_user_pub_date_idx")
+                   ]
+
+
+class UserCounters(models.Model):
+    """Денормализованные счётчики пользователя для карточки автора.
+    Обновляются сигналами при создании и удалении записей,
+    комментариев и подписок, сверяются командой reconcile_counters"""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name="Пользователь",
+        related_name="counters",
+    )
+    post_count = models.PositiveIntegerField("Записей", default=0)
+    follower_count = models.PositiveIntegerField("Подписчиков", default=0)
+    following_count = models.PositiveIntegerField("Подписок", default=0)
+    comment_count = models.PositiveIntegerField("Комментариев", default=0)
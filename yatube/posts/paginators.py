@@ -0,0 +1,216 @@
+"""Пагинация без полного COUNT(*).
+
+Курсорная (keyset) пагинация лент постов: вместо OFFSET/LIMIT и полного
+COUNT(*) страница выбирается по ключу (pub_date, id) последнего
+показанного поста, поэтому время выборки не зависит от глубины
+страницы. Положение в ленте передаётся непрозрачным токеном
+в параметре ?cursor=. Списки админки считаются приблизительно
+(EstimatedCountPaginator)"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class CountedPaginator(Paginator):
+    """Paginator, которому число объектов известно заранее
+    (из денормализованного счётчика), поэтому COUNT(*) не выполняется"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count
+
+
+def estimated_count(model, using="default"):
+    """Примерное число строк в таблице модели из статистики СУБД
+    или None, если статистики нет.
+
+    SQLite берёт его из sqlite_stat1 (заполняется командой ANALYZE),
+    PostgreSQL — из pg_class.reltuples"""
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        "sqlite": "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+        "postgresql": "SELECT reltuples FROM pg_class WHERE relname = %s",
+        "mysql": "SELECT table_rows FROM information_schema.tables "
+                 "WHERE table_schema = DATABASE() AND table_name = %s",
+    }
+    if connection.vendor not in queries:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(queries[connection.vendor], [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        # Нет таблицы статистики: ANALYZE ещё не запускался
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0].split(".")[0])
+    return estimate if estimate > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator для списков админки на больших таблицах.
+
+    Число строк всей таблицы берётся из статистики СУБД, а выборки
+    с фильтром или поиском считаются не дальше ADMIN_COUNT_LIMIT строк
+    после начала текущей страницы (start), поэтому ни одна страница
+    не делает COUNT(*) по всей таблице. Для таких выборок count — нижняя
+    оценка: последняя из показанных страниц ведёт дальше, и за пределами
+    лимита счёт сдвигается вместе с ней. Небольшие таблицы (меньше
+    ADMIN_COUNT_LIMIT по статистике или без неё) считаются точно"""
+
+    def __init__(self, object_list, per_page, start=0, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.start = start
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_COUNT_LIMIT
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:self.start + limit].count()
+
+
+class KeysetPage:
+    """Страница ленты, совместимая по интерфейсу с Page
+    в той части, которая используется в шаблонах"""
+
+    cursor_based = True
+
+    def __init__(self, object_list, paginator, cursor=None,
+                 next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f"<KeysetPage of {len(self.object_list)} items>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Пагинатор по ключу (pub_date, id) в порядке убывания.
+
+    Запрос страницы — это всегда индексируемый диапазон
+    с LIMIT per_page + 1: лишняя запись показывает, есть ли
+    следующая страница, поэтому COUNT(*) не нужен. Поля ключа можно
+    заменить (key): лента подписок идёт по индексу FeedEntry, а не
+    по постам. Значения ключа в курсоре берутся из pub_date и pk
+    поста, поэтому поля должны совпадать с ними по значению"""
+
+    def __init__(self, object_list, per_page, key=("pub_date", "pk")):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.date_field, self.id_field = key
+
+    @staticmethod
+    def encode_cursor(post, reverse=False):
+        """Упаковывает позицию поста в непрозрачный токен"""
+        payload = json.dumps(
+            [post.pub_date.isoformat(), post.pk, int(reverse)],
+            separators=(",", ":"),
+        )
+        token = base64.urlsafe_b64encode(payload.encode()).decode()
+        return token.rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Распаковывает токен; для повреждённого токена возвращает None"""
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            pub_date, pk, reverse = json.loads(
+                base64.urlsafe_b64decode(padded.encode()).decode())
+            return datetime.fromisoformat(pub_date), int(pk), bool(reverse)
+        except (binascii.Error, TypeError, ValueError, UnicodeDecodeError):
+            return None
+
+    def get_page(self, cursor):
+        """Возвращает страницу после (или перед) позицией из токена.
+        Пустой или некорректный токен означает первую страницу"""
+        position = self.decode_cursor(cursor) if cursor else None
+        queryset = self.object_list
+        if position is None:
+            return self._forward_page(queryset, None)
+        pub_date, pk, reverse = position
+        lookup = "gt" if reverse else "lt"
+        queryset = queryset.filter(
+            Q(**{f"{self.date_field}__{lookup}": pub_date})
+            | Q(**{self.date_field: pub_date,
+                   f"{self.id_field}__{lookup}": pk}))
+        if reverse:
+            return self._backward_page(queryset, cursor)
+        return self._forward_page(queryset, cursor)
+
+    def _ordered(self, queryset, descending):
+        sign = "-" if descending else ""
+        return queryset.order_by(f"{sign}{self.date_field}",
+                                 f"{sign}{self.id_field}")
+
+    def _forward_page(self, queryset, cursor):
+        rows = list(self._ordered(queryset, True)[:self.per_page + 1])
+        posts = rows[:self.per_page]
+        next_cursor = previous_cursor = None
+        if len(rows) > self.per_page:
+            next_cursor = self.encode_cursor(posts[-1])
+        if cursor and posts:
+            previous_cursor = self.encode_cursor(posts[0], reverse=True)
+        return KeysetPage(posts, self, cursor, next_cursor, previous_cursor)
+
+    def _backward_page(self, queryset, cursor):
+        rows = list(self._ordered(queryset, False)[:self.per_page + 1])
+        posts = rows[:self.per_page][::-1]
+        if not posts:
+            return self._forward_page(self.object_list, None)
+        next_cursor = self.encode_cursor(posts[-1])
+        previous_cursor = None
+        if len(rows) > self.per_page:
+            previous_cursor = self.encode_cursor(posts[0], reverse=True)
+        return KeysetPage(posts, self, cursor, next_cursor, previous_cursor)
+
+
+def get_feed_page(request, post_list, key=("pub_date", "pk")):
+    """Постраничный вывод ленты постов.
+
+    Режим выбирается настройкой POSTS_PAGINATION: "offset" — штатный
+    Paginator с номерами страниц, "keyset" — курсорная пагинация
+    по полям key (см. KeysetPaginator)"""
+    per_page = settings.POSTS_PER_PAGE
+    if settings.POSTS_PAGINATION == "keyset":
+        paginator = KeysetPaginator(post_list, per_page, key)
+        return paginator.get_page(request.GET.get("cursor"))
+    paginator = Paginator(post_list, per_page)
+    return paginator.get_page(request.GET.get("page"))
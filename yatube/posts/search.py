@@ -0,0 +1,218 @@
+"""Полнотекстовый поиск по текстам постов.
+
+Индекс обновляется сигналами при сохранении и удалении постов
+(см. signals.py); массовые операции в обход моделей (bulk_create,
+QuerySet.update, loaddata) нужно догонять командой rebuild_search_index.
+Реализация индекса выбирается настройкой POST_SEARCH_BACKEND, а без неё —
+по СУБД: таблица FTS5 создаётся миграцией только в SQLite"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .models import Post
+
+# Больше слов в запросе не учитывается: каждое слово — отдельный
+# проход по индексу
+MAX_TERMS = 8
+# Более короткие слова ищутся целиком: префикс из одной-двух букв
+# совпадает с большей частью постов, и их ранжирование занимает секунды
+MIN_PREFIX_LENGTH = 3
+
+# Реализация поиска по умолчанию для СУБД, остальные сканируют LIKE
+DEFAULT_BACKENDS = {"sqlite": "posts.search.SQLiteFTSBackend"}
+
+
+def normalize(text):
+    """Текст в том виде, в котором он попадает в индекс.
+
+    Регистр индекс приводит сам, а «ё» токенизатор FTS5 считает
+    отдельной буквой, поэтому «ёлка» и «елка» сводятся здесь"""
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def query_terms(query):
+    return re.findall(r"\w+", normalize(query))[:MAX_TERMS]
+
+
+class SearchResults:
+    """Ленивая выдача поиска для Paginator: count() и срез
+    выполняются отдельными запросами к индексу, посты страницы
+    читаются одним запросом"""
+
+    ordered = True
+
+    def __init__(self, backend, query, queryset):
+        self.backend = backend
+        self.query = query
+        self.queryset = queryset
+
+    def count(self):
+        return self._count
+
+    @cached_property
+    def _count(self):
+        return self.backend.count(self.query)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        ids = self.backend.ranked_ids(self.query, start, index.stop - start)
+        posts = self.queryset.in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+class SearchBackend:
+    """Интерфейс поискового индекса постов"""
+
+    def index(self, posts):
+        """Добавляет посты в индекс или обновляет их тексты"""
+        raise NotImplementedError
+
+    def remove(self, post_ids):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Строит индекс заново по всем постам; возвращает их число"""
+        raise NotImplementedError
+
+    def count(self, query):
+        raise NotImplementedError
+
+    def ranked_ids(self, query, offset, limit):
+        """id найденных постов, самые релевантные первыми"""
+        raise NotImplementedError
+
+    def filter(self, queryset, query):
+        """Посты queryset, подходящие под запрос (для админки)"""
+        raise NotImplementedError
+
+    def search(self, query, queryset=None):
+        if queryset is None:
+            queryset = Post.objects.all()
+        return SearchResults(self, query, queryset)
+
+
+class LikeSearchBackend(SearchBackend):
+    """Поиск без индекса, сканированием LIKE '%слово%' по всем постам.
+
+    Годится для небольших баз на СУБД без FTS5 и как точка отсчёта
+    в benchmark_search. Все слова запроса должны встретиться в тексте,
+    новые посты выше"""
+
+    def index(self, posts):
+        pass
+
+    def remove(self, post_ids):
+        pass
+
+    def rebuild(self):
+        return Post.objects.count()
+
+    def filter(self, queryset, query):
+        terms = query_terms(query)
+        if not terms:
+            return queryset.none()
+        for term in terms:
+            queryset = queryset.filter(text__icontains=term)
+        return queryset
+
+    def count(self, query):
+        return self.filter(Post.objects.all(), query).count()
+
+    def ranked_ids(self, query, offset, limit):
+        ids = self.filter(Post.objects.all(), query).values_list(
+            "id", flat=True).order_by("-pub_date", "-id")
+        return list(ids[offset:offset + limit])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """Инвертированный индекс на виртуальной таблице FTS5 SQLite.
+
+    Таблица создаётся миграцией 0018; rowid строки индекса равен id
+    поста. Слова запроса от MIN_PREFIX_LENGTH букв ищутся как префиксы
+    («пост» находит «посты»), выдача упорядочена по BM25"""
+
+    table = "posts_post_fts"
+
+    def match_expression(self, query):
+        # Каждое слово в кавычках: спецсинтаксис FTS5 из запроса
+        # пользователя не интерпретируется
+        return " ".join(
+            f'"{term}"*' if len(term) >= MIN_PREFIX_LENGTH else f'"{term}"'
+            for term in query_terms(query))
+
+    def index(self, posts):
+        rows = [(post.pk, normalize(post.text)) for post in posts]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.table} WHERE rowid = %s",
+                [(pk,) for pk, _ in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, text) VALUES (%s, %s)",
+                rows)
+
+    def remove(self, post_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s",
+                               [(pk,) for pk in post_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, text) "
+                f"SELECT id, replace(replace(text, 'ё', 'е'), 'Ё', 'Е') "
+                f"FROM posts_post")
+            cursor.execute(
+                f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+            cursor.execute(f"SELECT count(*) FROM {self.table}")
+            return cursor.fetchone()[0]
+
+    def _match_sql(self):
+        return f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s"
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(self._match_sql(),
+                                             [expression]))
+
+    def count(self, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM ({self._match_sql()})",
+                           [expression])
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, query, offset, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"{self._match_sql()} ORDER BY rank, rowid DESC "
+                f"LIMIT %s OFFSET %s", [expression, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+def get_backend():
+    path = settings.POST_SEARCH_BACKEND or DEFAULT_BACKENDS.get(
+        connection.vendor, "posts.search.LikeSearchBackend")
+    return import_string(path)()
+
+
+def search_posts(query):
+    """Выдача поиска с авторами и группами постов"""
+    return get_backend().search(
+        query, Post.objects.select_related("author", "group"))
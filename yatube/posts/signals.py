@@ -0,0 +1,202 @@
+"""Обработчики сигналов моделей приложения posts"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from . import counters, search, timeline
+from .cache import bump_feed_versions, post_feed_scopes
+from .models import Comment, Follow, Group, Post
+
+logger = logging.getLogger(__name__)
+
+# Посты, которые сейчас удаляются в этом потоке
+_deleting = threading.local()
+
+
+def _deleting_posts():
+    if not hasattr(_deleting, "post_ids"):
+        _deleting.post_ids = set()
+    return _deleting.post_ids
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleting_post(sender, instance, **kwargs):
+    """Комментарии поста удаляются каскадом раньше него самого:
+    счётчик и кеш ветки удаляемого поста обновлять незачем"""
+    _deleting_posts().add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleted_post(sender, instance, **kwargs):
+    _deleting_posts().discard(instance.pk)
+
+
+# Счётчики обновляются раньше лент: решение о fan-out зависит
+# от числа подписчиков автора
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change(instance.author_id, post_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change(instance.author_id, create_missing=False, post_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change(instance.author_id, comment_count=1)
+        counters.change_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change(instance.author_id, create_missing=False,
+                    comment_count=-1)
+    if instance.post_id not in _deleting_posts():
+        counters.change_comment_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change(instance.author_id, follower_count=1)
+        counters.change(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    # При удалении пользователя его строка счётчиков может быть уже
+    # удалена каскадом, поэтому недостающие строки здесь не создаются
+    counters.change(instance.author_id, create_missing=False,
+                    follower_count=-1)
+    counters.change(instance.user_id, create_missing=False,
+                    following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    """Раскладывает новый пост по лентам подписчиков"""
+    if created and not raw:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_new_follow(sender, instance, created, raw=False, **kwargs):
+    """Заполняет ленту подписчика постами нового автора"""
+    if created and not raw:
+        timeline.backfill_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_deleted_follow(sender, instance, **kwargs):
+    """Очищает ленту от постов автора после отписки"""
+    timeline.trim_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def backfill_demoted_author(sender, instance, **kwargs):
+    """Автор, переставший быть популярным, снова читается из лент"""
+    timeline.backfill_demoted_author(instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_state(sender, instance, raw=False, **kwargs):
+    """Запоминает прежние группу, картинку и текст поста: ленту старой
+    группы нужно сбросить, старую картинку — освободить, а неизменный
+    текст не переиндексировать"""
+    if instance.pk and not raw:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            "group_id", "image", "text").first()
+        (instance._old_group_id, instance._old_image,
+         instance._old_text) = old or (None, None, None)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_feeds(sender, instance, **kwargs):
+    """Новые, изменённые и удалённые посты сразу видны в лентах"""
+    scopes = post_feed_scopes(instance.author_id, instance.group_id)
+    old_group_id = getattr(instance, "_old_group_id", None)
+    if old_group_id and old_group_id != instance.group_id:
+        scopes.append(f"group:{old_group_id}")
+    bump_feed_versions(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_thread(sender, instance, **kwargs):
+    """Новые, изменённые и удалённые комментарии сразу видны"""
+    if instance.post_id not in _deleting_posts():
+        bump_feed_versions(f"comments:{instance.post_id}")
+
+
+@receiver(post_save, sender=Group)
+def bump_group_page(sender, instance, **kwargs):
+    """Название и описание группы выводятся на странице группы"""
+    bump_feed_versions(f"group:{instance.pk}")
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_feed(sender, instance, **kwargs):
+    """Подписка и отписка меняют ленту подписок пользователя"""
+    bump_feed_versions(f"follow:{instance.user_id}")
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, raw=False, **kwargs):
+    """Новый или изменённый текст поста сразу попадает в поиск;
+    загруженные loaddata посты добавляет rebuild_search_index"""
+    if raw:
+        return
+    if getattr(instance, "_old_text", None) != instance.text:
+        search.get_backend().index([instance])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.get_backend().remove([instance.pk])
+
+
+def release_image(name):
+    """Удаляет картинку и её миниатюры, если на неё не ссылается
+    ни один пост. Картинки хранятся по содержимому и общие для постов
+    с одинаковыми загрузками, поэтому ссылки пересчитываются по базе.
+
+    Недавно загруженный заново файл не трогаем: пост, который на него
+    сошлётся, может быть ещё не сохранён"""
+    if Post.objects.filter(image=name).exists():
+        return
+    image = Post(image=name).image
+    grace = settings.POST_IMAGE_RELEASE_GRACE
+    try:
+        if image.storage.recently_used(name, grace):
+            return
+        default.kvstore.delete(ImageFile(image))
+        image.storage.delete(name)
+    except Exception:
+        logger.exception("Не удалось удалить картинку %s", name)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, raw=False, **kwargs):
+    old_image = getattr(instance, "_old_image", None)
+    if not raw and old_image and old_image != instance.image.name:
+        transaction.on_commit(lambda: release_image(old_image))
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        name = instance.image.name
+        transaction.on_commit(lambda: release_image(name))
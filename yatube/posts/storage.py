@@ -0,0 +1,67 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Файл называется по SHA-256 своего содержимого, поэтому одинаковые
+загрузки хранятся один раз, а миниатюры sorl-thumbnail (их ключ зависит
+от имени исходника) тоже становятся общими. Файл удаляется, только
+когда на него не ссылается ни один пост (см. release_image в signals.py)"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, сохраняющий файл под именем
+    <каталог upload_to>/<2 символа хеша>/<хеш><расширение>"""
+
+    @staticmethod
+    def content_hash(content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым: одинаковое имя — тот же файл
+        return name
+
+    def _save(self, name, content):
+        digest = self.content_hash(content)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest[:2], digest + extension)
+        path = self.path(name)
+        if os.path.exists(path):
+            # Отметка времени защищает файл от удаления, пока новый пост
+            # с ним ещё не сохранён (см. recently_used)
+            os.utime(path)
+            return name
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Пишем во временный файл и атомарно переименовываем: параллельная
+        # загрузка того же файла запишет то же самое содержимое
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    def recently_used(self, name, seconds):
+        """Файл записан или повторно загружен не раньше seconds назад"""
+        try:
+            return time.time() - os.path.getmtime(self.path(name)) < seconds
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,27 @@
+from django import template
+
+from posts.thumbnails import picture_for, prefetch_pictures, ready_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(image, geometry):
+    """Готовая миниатюра изображения поста или None, если она ещё
+    строится: {% post_thumbnail post.image "960x339" as im %}"""
+    return ready_thumbnail(image, geometry)
+
+
+@register.simple_tag
+def post_picture(post):
+    """Все варианты изображения поста для <picture> или None:
+    {% post_picture post as picture %}"""
+    return picture_for(post)
+
+
+@register.simple_tag
+def prefetch_post_pictures(posts):
+    """Ищет картинки всех постов страницы одним запросом:
+    {% prefetch_post_pictures page %} перед циклом по постам"""
+    prefetch_pictures(posts)
+    return ""
@@ -1,23 +1,27 @@
 import shutil
 import tempfile
+from io import BytesIO
 
 from django.conf import settings
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+from PIL import Image
+
+from posts.forms import PostForm
 from posts.models import Group, Post
 
 User = get_user_model()
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), THUMBNAIL_PIPELINE="sync")
 class PostCreateFormTests(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
-        settings.MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
         cls.user1 = User.objects.create(username="testuser2")
         cls.user1.save()
@@ -148,3 +152,57 @@ class PostCreateFormTests(TestCase):
         post_edit_response = PostCreateFormTests.post1
         new_text = post_edit_response.text
         self.assertEqual(new_text, "Тестовый текст добавлен текст")
+
+
+@override_settings(POST_IMAGE_MAX_SIDE=100)
+class PostImageNormalizationTests(TestCase):
+    @staticmethod
+    def upload(size=(300, 200), image_format="JPEG", name="photo.jpg",
+               **save_options):
+        content = BytesIO()
+        Image.new("RGB", size, (200, 30, 30)).save(
+            content, image_format, **save_options)
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def clean_image(self, upload):
+        form = PostForm(data={"text": "Текст"}, files={"image": upload})
+        self.assertTrue(form.is_valid(), form.errors)
+        image = form.cleaned_data["image"]
+        image.seek(0)
+        return image, Image.open(image)
+
+    def test_large_photo_is_downsampled_without_exif(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Camera"
+        exif[0x0112] = 6
+        _, image = self.clean_image(self.upload(exif=exif.tobytes()))
+        self.assertEqual(image.format, "JPEG")
+        # Ориентация применена до уменьшения: снимок стал вертикальным
+        self.assertEqual(image.size, (67, 100))
+        self.assertFalse(image.getexif())
+
+    def test_small_gif_is_kept_as_is(self):
+        upload = self.upload((2, 1), "GIF", "small.gif")
+        image, opened = self.clean_image(upload)
+        self.assertIs(image, upload)
+        self.assertEqual(opened.format, "GIF")
+
+    def test_unsupported_format_is_reencoded(self):
+        image, opened = self.clean_image(
+            self.upload((50, 50), "BMP", "scan.bmp"))
+        self.assertEqual(image.name, "scan.jpg")
+        self.assertEqual(opened.format, "JPEG")
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_oversized_upload_is_rejected(self):
+        form = PostForm(data={"text": "Текст"},
+                        files={"image": self.upload()})
+        self.assertFalse(form.is_valid())
+        self.assertIn("image", form.errors)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100 * 100)
+    def test_too_many_pixels_is_rejected(self):
+        form = PostForm(data={"text": "Текст"},
+                        files={"image": self.upload()})
+        self.assertFalse(form.is_valid())
+        self.assertIn("image", form.errors)
@@ -1,6 +1,21 @@
 # deals/tests/tests_models.py
-from django.test import TestCase
-from posts.models import Post, Group
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from posts import counters
+from posts.models import (Comment, FeedEntry, Follow, Group, Post,
+                          UserCounters)
+from posts.search import get_backend
+from posts.signals import release_image
+from posts.timeline import timeline_posts
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -103,3 +118,277 @@ class GroupModelTest(TestCase):
         group = GroupModelTest.group
         expected_object_name = group.title
         self.assertEqual(expected_object_name, str(group))
+
+
+class FeedEntryModelTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username="reader")
+        cls.author = User.objects.create(username="writer")
+        cls.old_post = Post.objects.create(text="Старый пост",
+                                           author=cls.author)
+
+    def test_follow_backfills_and_unfollow_trims_feed(self):
+        """Подписка добавляет посты автора в ленту, отписка — убирает"""
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(
+            list(self.reader.feed_entries.values_list("post_id", flat=True)),
+            [self.old_post.id])
+        follow.delete()
+        self.assertFalse(self.reader.feed_entries.exists())
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков автора"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text="Новый пост", author=self.author)
+        self.assertTrue(
+            self.reader.feed_entries.filter(post=post).exists())
+
+    def test_rebuild_timelines_command(self):
+        """Команда rebuild_timelines восстанавливает ленты по подпискам"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        FeedEntry.objects.all().delete()
+        call_command("rebuild_timelines", stdout=StringIO())
+        self.assertEqual(self.reader.feed_entries.count(), 1)
+
+    @override_settings(TIMELINE_CELEBRITY_THRESHOLD=0)
+    def test_celebrity_posts_are_read_not_fanned_out(self):
+        """Посты популярных авторов не пишутся в ленты,
+        но попадают в ленту подписок при чтении"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text="Пост звезды", author=self.author)
+        self.assertFalse(self.reader.feed_entries.exists())
+        self.assertEqual(list(timeline_posts(self.reader)),
+                         [post, self.old_post])
+
+    @override_settings(TIMELINE_CELEBRITY_THRESHOLD=1)
+    def test_demoted_celebrity_posts_stay_in_feed(self):
+        """Посты, опубликованные автором в статусе популярного,
+        остаются в лентах, когда подписчиков становится меньше"""
+        other = User.objects.create(username="other")
+        Follow.objects.create(user=self.reader, author=self.author)
+        follow = Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(text="Пост звезды", author=self.author)
+        self.assertFalse(self.reader.feed_entries.filter(post=post).exists())
+
+        follow.delete()
+        self.assertTrue(self.reader.feed_entries.filter(post=post).exists())
+        self.assertEqual(list(timeline_posts(self.reader)),
+                         [post, self.old_post])
+
+
+class UserCountersModelTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username="reader")
+        cls.author = User.objects.create(username="writer")
+
+    def test_counters_follow_writes_and_deletes(self):
+        """Счётчики меняются вместе с записями, комментариями
+        и подписками"""
+        post = Post.objects.create(text="Пост", author=self.author)
+        comment = Comment.objects.create(text="Комментарий", post=post,
+                                         author=self.reader)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        author = UserCounters.objects.get(user=self.author)
+        reader = UserCounters.objects.get(user=self.reader)
+        self.assertEqual((author.post_count, author.follower_count), (1, 1))
+        self.assertEqual((reader.comment_count, reader.following_count),
+                         (1, 1))
+
+        comment.delete()
+        follow.delete()
+        post.delete()
+        author.refresh_from_db()
+        reader.refresh_from_db()
+        self.assertEqual((author.post_count, author.follower_count), (0, 0))
+        self.assertEqual((reader.comment_count, reader.following_count),
+                         (0, 0))
+
+    def test_counters_do_not_go_below_zero(self):
+        """Удаление записи, загруженной без сигналов, не ломает
+        ограничение PositiveIntegerField"""
+        Follow(user=self.reader, author=self.author).save_base(raw=True)
+        UserCounters.objects.create(user=self.author)
+        UserCounters.objects.create(user=self.reader)
+        Follow.objects.get().delete()
+        self.assertEqual(
+            UserCounters.objects.get(user=self.author).follower_count, 0)
+
+    def test_concurrently_created_counters_are_reused(self):
+        """Строку мог создать параллельный запрос к профилю"""
+        actual_counters = counters.actual_counters
+
+        def race(user_ids):
+            result = actual_counters(user_ids)
+            UserCounters.objects.create(user=self.author, post_count=3)
+            return result
+
+        with mock.patch("posts.counters.actual_counters", race):
+            found = counters.counters_for(self.author)
+        self.assertEqual(found.post_count, 3)
+
+    def test_reconcile_counters_command(self):
+        """Команда reconcile_counters исправляет расхождения"""
+        Post.objects.create(text="Пост", author=self.author)
+        UserCounters.objects.filter(user=self.author).update(post_count=7)
+        call_command("reconcile_counters", stdout=StringIO())
+        self.assertEqual(
+            UserCounters.objects.get(user=self.author).post_count, 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), POST_IMAGE_RELEASE_GRACE=0)
+class ContentAddressedImageTest(TestCase):
+    small_gif = (b"\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\xff"
+                 b"\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02"
+                 b"\x00\x3b")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username="meme_lord")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_post(self, name="meme.gif"):
+        return Post.objects.create(
+            text="Мем", author=self.author,
+            image=SimpleUploadedFile(name, self.small_gif))
+
+    def test_same_upload_is_stored_once(self):
+        first = self.create_post("meme.gif")
+        second = self.create_post("copy of meme.GIF")
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name,
+                         r"^posts/[0-9a-f]{2}/[0-9a-f]{64}\.gif$")
+        self.assertEqual(
+            len(os.listdir(os.path.dirname(first.image.path))), 1)
+
+    def test_image_is_deleted_with_last_reference(self):
+        first = self.create_post()
+        second = self.create_post()
+        path = first.image.path
+
+        first.delete()
+        release_image(first.image.name)
+        self.assertTrue(os.path.exists(path))
+
+        second.delete()
+        release_image(second.image.name)
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(POST_IMAGE_RELEASE_GRACE=60)
+    def test_recently_uploaded_image_is_kept(self):
+        """Файл, который только что загрузили снова, не удаляется:
+        новый пост с ним может быть ещё не сохранён"""
+        post = self.create_post()
+        post.delete()
+        release_image(post.image.name)
+        self.assertTrue(os.path.exists(post.image.path))
+
+
+class SeedDataTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command("seed_data", users=60, groups=4, posts=300,
+                     comments=400, follows=6, days=30, seed=1,
+                     stdout=StringIO())
+
+    def test_bulk_rows_and_derived_data(self):
+        """Строки созданы, счётчики, ленты и индекс построены по ним"""
+        self.assertEqual(User.objects.filter(
+            username__startswith="seed").count(), 60)
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(Comment.objects.count(), 400)
+        self.assertEqual(sum(Post.objects.values_list("comment_count",
+                                                      flat=True)), 400)
+        self.assertEqual(sum(UserCounters.objects.values_list(
+            "follower_count", flat=True)), Follow.objects.count())
+        reader = Follow.objects.first().user
+        self.assertTrue(timeline_posts(reader).exists())
+
+    def test_dates_are_spread_and_ordered_by_id(self):
+        dates = list(Post.objects.order_by("id").values_list(
+            "pub_date", flat=True))
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreater((dates[-1] - dates[0]).days, 25)
+
+    def test_follower_graph_is_skewed(self):
+        """Несколько авторов собирают непропорционально много подписчиков"""
+        followers = sorted(UserCounters.objects.values_list(
+            "follower_count", flat=True), reverse=True)
+        self.assertGreater(followers[0], 5 * followers[len(followers) // 2])
+
+    def test_existing_prefix_is_refused(self):
+        with self.assertRaises(CommandError):
+            call_command("seed_data", users=1, stdout=StringIO())
+
+
+class SnapshotTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username="leo")
+        cls.reader = User.objects.create(username="pierre")
+        cls.group = Group.objects.create(title="Война", slug="war")
+        cls.post = Post.objects.create(text="Ёлка в снегу",
+                                       author=cls.author, group=cls.group)
+        Post.objects.filter(pk=cls.post.pk).update(
+            pub_date="2020-01-02 03:04:05.123456")
+        cls.comment = Comment.objects.create(text="Мир", post=cls.post,
+                                             author=cls.reader)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def export(self, name="snapshot.ndjson.gz"):
+        path = os.path.join(self.directory, name)
+        call_command("export_posts", path, stdout=StringIO())
+        return path
+
+    def test_export_writes_one_object_per_line(self):
+        path = self.export("snapshot.ndjson")
+        with open(path, encoding="utf-8") as snapshot:
+            models = [json.loads(line)["model"] for line in snapshot]
+        self.assertEqual(models, ["auth.user", "auth.user", "posts.group",
+                                  "posts.post", "posts.comment",
+                                  "posts.follow"])
+
+    def test_round_trip_keeps_ids_dates_and_derived_data(self):
+        path = self.export()
+        pub_date = Post.objects.get(pk=self.post.pk).pub_date
+        for model in (Follow, Comment, Post, Group, User):
+            model.objects.all().delete()
+
+        call_command("import_posts", path, batch_size=2, stdout=StringIO())
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertEqual((post.author_id, post.group_id),
+                         (self.author.pk, self.group.pk))
+        self.assertEqual(Comment.objects.get().pk, self.comment.pk)
+        self.assertEqual(self.reader.counters.following_count, 1)
+        self.assertEqual(list(timeline_posts(self.reader)), [post])
+        self.assertEqual(list(get_backend().search("елка")), [post])
+
+    def test_existing_rows_fail_unless_ignored(self):
+        path = self.export()
+        with self.assertRaises(CommandError):
+            call_command("import_posts", path, stdout=StringIO())
+        call_command("import_posts", path, ignore_conflicts=True,
+                     stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_foreign_models_are_refused(self):
+        path = os.path.join(self.directory, "dump.ndjson")
+        with open(path, "w", encoding="utf-8") as snapshot:
+            snapshot.write('{"model": "sessions.session", "pk": "x", '
+                           '"fields": {}}\n')
+        with self.assertRaisesMessage(CommandError, "Строка 1"):
+            call_command("import_posts", path, stdout=StringIO())
@@ -1,16 +1,37 @@
+import json
+import os
 import shutil
 import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
 
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django import forms
 
-from posts.models import Post, Group
+from PIL import Image
+
+from posts.admin import PostAdmin
+from posts.cache import feed_versions, follow_feed_version
+from posts.models import Comment, Follow, Group, Post, UserCounters
+from posts.paginators import (EstimatedCountPaginator, KeysetPaginator,
+                              estimated_count)
+from posts.search import (LikeSearchBackend, SQLiteFTSBackend,
+                          get_backend)
+from posts.thumbnails import (ThumbnailQueue, enqueue, generate_thumbnails,
+                              missing_thumbnails, ready_picture,
+                              ready_thumbnail, thumbnail_options, variants)
+from posts.urls import urlpatterns
+from sorl.thumbnail import default
 
 User = get_user_model()
 
@@ -219,21 +240,62 @@ class PostPagesTests(TestCase):
         self.assertNotEqual(post_text_added2, "Новый автотекст")
 
     def test_cache_on_index_page(self):
-        """ Проверяем правильность кеширования главной страницы"""
+        """ Проверяем правильность кеширования главной страницы:
+        фрагмент берётся из кеша, пока лента не изменилась,
+        а новый пост виден сразу"""
         response1 = self.authorized_client1.get(reverse("index"))
         response1_content = response1.content
+        # update() не вызывает сигналов, версия ленты остаётся прежней
+        Post.objects.filter(pk=PostPagesTests.post1.pk).update(
+            text="Изменено в обход модели")
+        response2 = self.authorized_client1.get(reverse("index"))
+        response2_content = response2.content
+        self.assertEqual(response1_content, response2_content)
         Post.objects.create(
             text="Тестовый текст 222",
             author=PostPagesTests.user1,
             group=PostPagesTests.group
         )
-        response2 = self.authorized_client1.get(reverse("index"))
-        response2_content = response2.content
-        self.assertEqual(response1_content, response2_content)
-        cache.clear()
         response3 = self.authorized_client1.get(reverse("index"))
-        response3_content = response3.content
-        self.assertNotEqual(response1_content, response3_content)
+        self.assertContains(response3, "Тестовый текст 222")
+
+    def test_follow_page_cache_is_per_user(self):
+        """Закешированная лента подписок одного пользователя
+        не показывается другому"""
+        Post.objects.create(
+            text="Тестовый текст user3", author=self.user3, group=self.group)
+        self.authorized_client1.get(
+            reverse("profile_follow",
+                    kwargs={"username": self.user3.username}))
+        response1 = self.authorized_client1.get(reverse("follow_index"))
+        self.assertContains(response1, "Тестовый текст user3")
+        response2 = self.authorized_client2.get(reverse("follow_index"))
+        self.assertNotContains(response2, "Тестовый текст user3")
+
+    def test_follow_feed_version_skips_fanned_out_authors(self):
+        """Версия ленты подписок читает версии только популярных
+        авторов: посты остальных меняют версию подписчика"""
+        for author in (self.user2, self.user3):
+            Follow.objects.create(user=self.user1, author=author)
+        own = f"follow:{self.user1.pk}"
+        with mock.patch("posts.cache.feed_versions",
+                        wraps=feed_versions) as versions:
+            before = follow_feed_version(self.user1)
+        versions.assert_called_once_with(own)
+        post = Post.objects.create(text="Новый пост", author=self.user2)
+        self.assertNotEqual(follow_feed_version(self.user1), before)
+        before = follow_feed_version(self.user1)
+        post.text = "Исправленный пост"
+        post.save()
+        self.assertNotEqual(follow_feed_version(self.user1), before)
+
+        with override_settings(TIMELINE_CELEBRITY_THRESHOLD=0), \
+                mock.patch("posts.cache.feed_versions",
+                           wraps=feed_versions) as versions:
+            follow_feed_version(self.user1)
+        versions.assert_called_once_with(
+            own, *[f"author:{pk}"
+                   for pk in sorted((self.user2.pk, self.user3.pk))])
 
     def test_auth_user_can_sign_up(self):
         """Проверяем, что пользователь может подписаться на другого
@@ -297,11 +359,11 @@ class PostPagesTests(TestCase):
         self.assertEqual(follow_post_user2_2, follow_post_user2_1)
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), THUMBNAIL_PIPELINE="sync")
 class PostImagesTests(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
-        settings.MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
         cls.user1 = User.objects.create(username="testuser2")
         cls.user1.save()
@@ -375,6 +437,153 @@ class PostImagesTests(TestCase):
         self.assertEqual(image_post, PostImagesTests.post2.image)
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), THUMBNAIL_PIPELINE="sync")
+class ThumbnailPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username="painter")
+        cls.post = Post.objects.create(
+            text="Пост с картинкой",
+            author=cls.user,
+            image=SimpleUploadedFile(
+                name="small.gif",
+                content=(b"\x47\x49\x46\x38\x39\x61\x02\x00"
+                         b"\x01\x00\x80\x00\x00\x00\x00\x00"
+                         b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+                         b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+                         b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+                         b"\x0A\x00\x3B"),
+                content_type="image/gif"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore.local.clear()
+
+    def use_thread_queue(self):
+        """Очередь теста: её потоки завершаются до удаления MEDIA_ROOT"""
+        queue = ThumbnailQueue(workers=1)
+        self.addCleanup(queue._executor.shutdown)
+        patcher = mock.patch("posts.thumbnails._queue", queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generate_thumbnails_fills_kvstore(self):
+        """После генерации все размеры находятся без обращения к картинке"""
+        generate_thumbnails(self.post.image)
+        for geometry, fmt in variants():
+            with self.subTest(geometry=geometry, format=fmt):
+                self.assertIsNotNone(default.backend.get_cached_thumbnail(
+                    self.post.image, geometry,
+                    **thumbnail_options(geometry, fmt)))
+
+    @override_settings(THUMBNAIL_PIPELINE="thread")
+    def test_missing_thumbnail_shows_placeholder(self):
+        """Пока миниатюры нет, страница показывает заглушку,
+        а не строит её в запросе"""
+        self.use_thread_queue()
+        with mock.patch("posts.thumbnails.generate_thumbnails") as generate:
+            response = self.client.get(reverse("index"))
+        self.assertContains(response, "aspect-ratio: 960 / 339")
+        self.assertNotContains(response, "<img")
+        generate.assert_not_called()
+
+    @override_settings(THUMBNAIL_PIPELINE="thread")
+    def test_finished_build_refreshes_cached_pages(self):
+        """Ленты с заглушкой сбрасываются, когда миниатюры готовы"""
+        self.use_thread_queue()
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "aspect-ratio: 960 / 339")
+        ThumbnailQueue(workers=1)._run(self.post.image)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "<picture>")
+
+    def test_broken_image_is_not_retried(self):
+        """Картинку, которую не удалось прочитать, не пытаются строить
+        при каждом показе"""
+        image = Post(image="posts/missing.gif").image
+        with self.assertLogs(level="ERROR"):
+            self.assertIsNone(ready_picture(image))
+        with mock.patch("posts.thumbnails.generate_thumbnails") as generate:
+            self.assertIsNone(ready_picture(image))
+        generate.assert_not_called()
+
+    def test_sync_pipeline_builds_immediately(self):
+        with mock.patch("posts.thumbnails.generate_thumbnails") as generate:
+            enqueue(self.post.image)
+        generate.assert_called_once_with(self.post.image)
+
+    def test_ready_thumbnail_is_rendered(self):
+        generate_thumbnails(self.post.image)
+        thumbnail = ready_thumbnail(self.post.image, "960x339")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, f'src="{thumbnail.url}"')
+
+    def test_picture_lists_every_width_and_format(self):
+        """<picture> перечисляет все ширины в WebP и запасном JPEG"""
+        generate_thumbnails(self.post.image)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, '<source type="image/webp"')
+        for geometry, fmt in variants():
+            thumbnail = ready_thumbnail(self.post.image, geometry, fmt)
+            with self.subTest(geometry=geometry, format=fmt):
+                self.assertTrue(thumbnail.url.endswith(
+                    ".webp" if fmt == "WEBP" else ".jpg"))
+                self.assertContains(
+                    response, f"{thumbnail.url} {thumbnail.width}w")
+
+    def test_page_thumbnails_are_fetched_in_one_query(self):
+        """Картинки всех постов страницы ищутся одним запросом к базе,
+        повторный показ берёт их из памяти процесса"""
+        for color in ("red", "green", "blue"):
+            content = BytesIO()
+            Image.new("RGB", (4, 4), color).save(content, "PNG")
+            Post.objects.create(
+                text=color, author=self.user,
+                image=SimpleUploadedFile(f"{color}.png", content.getvalue()))
+        for post in Post.objects.all():
+            generate_thumbnails(post.image)
+        cache.clear()
+        default.kvstore.local.clear()
+
+        def kvstore_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("index"))
+            self.assertEqual(response.content.count(b"<picture>"), 4)
+            return [query for query in queries.captured_queries
+                    if "thumbnail_kvstore" in query["sql"]]
+
+        self.assertEqual(len(kvstore_queries()), 1)
+        cache.clear()
+        self.assertEqual(kvstore_queries(), [])
+
+    def test_warm_thumbnails_resumes(self):
+        """Повторный прогрев пропускает уже построенные миниатюры"""
+        out = StringIO()
+        call_command("warm_thumbnails", processes=0, stdout=out)
+        self.assertIn("Построено: 1, пропущено: 0, ошибок: 0",
+                      out.getvalue())
+        self.assertEqual(missing_thumbnails(self.post.image), [])
+        out = StringIO()
+        call_command("warm_thumbnails", processes=0, stdout=out)
+        self.assertIn("Построено: 0, пропущено: 1", out.getvalue())
+
+    def test_warm_thumbnails_refreshes_cached_pages(self):
+        """Ленты с заглушками сбрасываются после прогрева"""
+        versions = feed_versions("index", f"author:{self.user.pk}")
+        call_command("warm_thumbnails", processes=0, stdout=StringIO())
+        self.assertNotEqual(
+            feed_versions("index", f"author:{self.user.pk}"), versions)
+        versions = feed_versions("index")
+        call_command("warm_thumbnails", processes=0, stdout=StringIO())
+        self.assertEqual(feed_versions("index"), versions)
+
+
 class PaginatorViewsTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -414,3 +623,538 @@ class PaginatorViewsTest(TestCase):
         response = self.authorized_client1.get(reverse("index") + "?page=2")
         posts = response.context.get("page").object_list
         self.assertEqual(len(posts), 3)
+
+
+@override_settings(POSTS_PAGINATION="keyset")
+class KeysetPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user1 = User.objects.create(username="testuser2")
+        cls.group = Group.objects.create(
+            title="ж" * 10,
+            slug="zh",
+            description="описание тестовой группы"
+        )
+        for i in range(13):
+            Post.objects.create(
+                text=f"Тестовый текст{i}",
+                author=cls.user1,
+                group=cls.group
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_cursor_walks_forward_and_back(self):
+        """Курсоры ведут на следующую и обратно на предыдущую страницу"""
+        first = self.guest_client.get(reverse("index")).context["page"]
+        self.assertEqual(len(first), 10)
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+
+        second = self.guest_client.get(
+            reverse("index"), {"cursor": first.next_cursor}
+        ).context["page"]
+        self.assertEqual(len(second), 3)
+        self.assertFalse(second.has_next())
+        self.assertEqual(
+            [post.text for post in second],
+            [f"Тестовый текст{i}" for i in range(2, -1, -1)])
+
+        back = self.guest_client.get(
+            reverse("index"), {"cursor": second.previous_cursor}
+        ).context["page"]
+        self.assertEqual([post.pk for post in back],
+                         [post.pk for post in first])
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Повреждённый курсор не ломает страницу"""
+        response = self.guest_client.get(
+            reverse("group_posts", kwargs={"slug": self.group.slug}),
+            {"cursor": "не-курсор"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["page"]), 10)
+
+    def test_page_fetch_does_not_count(self):
+        """Страница выбирается одним запросом, без COUNT(*)"""
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+        cursor = paginator.get_page(None).next_cursor
+        with self.assertNumQueries(1):
+            page = paginator.get_page(cursor)
+        self.assertEqual(len(page), 3)
+
+    def test_follow_feed_pages_by_feed_entries(self):
+        """Страницы ленты подписок — диапазоны по индексу FeedEntry,
+        в том числе с постами популярных авторов"""
+        reader = User.objects.create(username="reader")
+        Follow.objects.create(user=reader, author=self.user1)
+        self.guest_client.force_login(reader)
+        expected = list(Post.objects.order_by("-pub_date", "-id"))
+        for threshold in (None, 0):
+            with self.subTest(threshold=threshold), override_settings(
+                    TIMELINE_CELEBRITY_THRESHOLD=threshold):
+                first = self.guest_client.get(
+                    reverse("follow_index")).context["page"]
+                with CaptureQueriesContext(connection) as queries:
+                    second = self.guest_client.get(
+                        reverse("follow_index"),
+                        {"cursor": first.next_cursor}).context["page"]
+                self.assertEqual(list(first) + list(second), expected)
+                if threshold is None:
+                    self.assertTrue([
+                        query for query in queries
+                        if '"posts_feedentry"."pub_date" <' in query["sql"]])
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов к БД на страницу не зависит от числа постов:
+    если бюджет превышен, в шаблоны или view вернулся N+1"""
+
+    # Бюджеты для авторизованного пользователя: сессия и пользователь
+    # занимают два запроса из каждого бюджета
+    budgets = {
+        "index": 4,
+        "group_posts": 5,
+        "profile": 6,
+        "post": 5,
+        "follow_index": 6,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username="reader")
+        cls.group = Group.objects.create(
+            title="ж" * 10,
+            slug="zh",
+            description="описание тестовой группы"
+        )
+        cls.authors = [User.objects.create_user(username=f"author{i}")
+                       for i in range(10)]
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.post = Post.objects.create(text="Тестовый текст",
+                                       author=cls.authors[0],
+                                       group=cls.group)
+        Comment.objects.create(text="Комментарий", post=cls.post,
+                               author=cls.reader)
+
+    @classmethod
+    def add_posts(cls, count):
+        """Добавляет посты разных авторов и комментарии к cls.post"""
+        for i in range(count):
+            author = cls.authors[i % len(cls.authors)]
+            Post.objects.create(text=f"Тестовый текст{i}",
+                                author=author, group=cls.group)
+            Comment.objects.create(text="Комментарий", post=cls.post,
+                                   author=author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def urls(self):
+        author = self.post.author.username
+        return {
+            "index": reverse("index"),
+            "group_posts": reverse("group_posts",
+                                   kwargs={"slug": self.group.slug}),
+            "profile": reverse("profile", kwargs={"username": author}),
+            "post": reverse("post", kwargs={"username": author,
+                                            "post_id": self.post.id}),
+            "follow_index": reverse("follow_index"),
+        }
+
+    def assertQueryBudget(self, name, url):
+        cache.clear()
+        with self.assertNumQueries(self.budgets[name]):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_pages_fit_query_budget(self):
+        """Страницы укладываются в бюджет запросов при любом
+        числе постов, авторов и комментариев"""
+        for posts_count in (0, 20):
+            self.add_posts(posts_count)
+            for name, url in self.urls().items():
+                with self.subTest(page=name, posts=posts_count):
+                    self.assertQueryBudget(name, url)
+
+
+@override_settings(COMMENTS_PER_PAGE=2)
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user1 = User.objects.create_user(username="testuser2")
+        cls.post = Post.objects.create(text="Тестовый текст",
+                                       author=cls.user1)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client1 = Client()
+        self.authorized_client1.force_login(self.user1)
+        self.url = reverse("post", kwargs={"username": self.user1.username,
+                                           "post_id": self.post.id})
+
+    def add_comment(self, text):
+        self.authorized_client1.post(
+            reverse("add_comment", kwargs={"username": self.user1.username,
+                                           "post_id": self.post.id}),
+            {"text": text})
+
+    def test_comment_count_is_maintained(self):
+        """Счётчик комментариев поста растёт и уменьшается"""
+        self.add_comment("Первый")
+        self.add_comment("Второй")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        self.post.comments.first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_failed_counter_update_rolls_back_comment(self):
+        """Комментарий и счётчики пишутся в одной транзакции"""
+        with mock.patch("posts.counters.change_comment_count",
+                        side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.add_comment("Первый")
+        self.assertFalse(self.post.comments.exists())
+        self.assertEqual(
+            UserCounters.objects.get(user=self.user1).comment_count, 0)
+
+    def test_cached_thread_is_invalidated_by_new_comment(self):
+        """Закешированная ветка комментариев сбрасывается
+        при добавлении комментария"""
+        self.add_comment("Первый")
+        self.authorized_client1.get(self.url)
+        self.add_comment("Второй")
+        response = self.authorized_client1.get(self.url)
+        self.assertContains(response, "Второй")
+
+    def test_cached_thread_is_invalidated_by_deleted_comment(self):
+        self.add_comment("Первый")
+        self.authorized_client1.get(self.url)
+        self.post.comments.get().delete()
+        response = self.authorized_client1.get(self.url)
+        self.assertNotContains(response, "Первый")
+
+    def test_post_delete_skips_per_comment_updates(self):
+        """Каскадное удаление комментариев вместе с постом
+        не обновляет счётчик и кеш ветки удаляемого поста"""
+        post = Post.objects.create(text="Удаляемый", author=self.user1)
+        post_id = post.id
+        for text in ("Первый", "Второй", "Третий"):
+            Comment.objects.create(text=text, post=post, author=self.user1)
+        with mock.patch("posts.signals.bump_feed_versions") as bump:
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+        self.assertFalse([query for query in queries.captured_queries
+                          if query["sql"].startswith('UPDATE "posts_post"')])
+        self.assertNotIn(mock.call(f"comments:{post_id}"),
+                         bump.call_args_list)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.user1).comment_count, 0)
+
+    def test_comments_are_paginated(self):
+        """Комментарии выводятся постранично"""
+        for text in ("Первый", "Второй", "Третий"):
+            self.add_comment(text)
+        response = self.authorized_client1.get(self.url, {"page": 2})
+        self.assertEqual([comment.text for comment in
+                          response.context["comments"]], ["Третий"])
+        self.assertEqual(response.context["comments_page"].paginator.count,
+                         3)
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user1 = User.objects.create_user(username="testuser2")
+        cls.group = Group.objects.create(
+            title="ж" * 10,
+            slug="zh",
+            description="описание тестовой группы"
+        )
+        cls.post1 = Post.objects.create(text="Тестовый текст",
+                                        author=cls.user1, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.urls = [
+            reverse("index"),
+            reverse("group_posts", kwargs={"slug": self.group.slug}),
+            reverse("profile", kwargs={"username": self.user1.username}),
+            reverse("post", kwargs={"username": self.user1.username,
+                                    "post_id": self.post1.id}),
+        ]
+
+    def test_revalidation_returns_not_modified(self):
+        """Страницы отдают ETag и Last-Modified и отвечают 304"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertTrue(response.has_header("Last-Modified"))
+                revalidated = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(revalidated.status_code, 304)
+
+    def test_cached_page_changes_with_data(self):
+        """Ответ берётся из кеша, пока данные страницы не изменились"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.guest_client.get(url)
+                # Ответ из кеша не рендерит шаблон заново
+                self.assertIsNone(self.guest_client.get(url).context)
+        response = self.guest_client.get(self.urls[0])
+        Post.objects.create(text="Новый пост", author=self.user1,
+                            group=self.group)
+        new_response = self.guest_client.get(self.urls[0])
+        self.assertNotEqual(response["ETag"], new_response["ETag"])
+        self.assertContains(new_response, "Новый пост")
+
+    def test_group_edit_changes_group_page(self):
+        url = self.urls[1]
+        response = self.guest_client.get(url)
+        self.group.description = "Новое описание"
+        self.group.save()
+        new_response = self.guest_client.get(url)
+        self.assertNotEqual(response["ETag"], new_response["ETag"])
+        self.assertContains(new_response, "Новое описание")
+
+    def test_authorized_users_are_not_cached(self):
+        """Авторизованные пользователи получают страницу без ETag"""
+        client = Client()
+        client.force_login(self.user1)
+        response = client.get(self.urls[0])
+        self.assertFalse(response.has_header("ETag"))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user1 = User.objects.create_user(username="testuser2")
+        cls.tree = Post.objects.create(
+            text="Лес, лес и снова лес: ёлка в лесу",
+            author=cls.user1)
+        cls.forest = Post.objects.create(text="Прогулка по лесу и полю",
+                                         author=cls.user1)
+        cls.other = Post.objects.create(text="Про котов",
+                                        author=cls.user1)
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(reverse("search"),
+                                         {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def found(self, query):
+        return [post.text for post in self.search(query).context["page"]]
+
+    def test_ranked_prefix_search(self):
+        """Пост, где слово встречается чаще, выше; слова ищутся
+        по началу, «ё» и «е» не различаются"""
+        self.assertEqual(self.found("елк"), [self.tree.text])
+        self.assertEqual(self.found("ЛЕС"), [self.tree.text,
+                                             self.forest.text])
+        self.assertEqual(self.found("лесу прогулка"), [self.forest.text])
+        self.assertEqual(self.found("собака"), [])
+
+    def test_no_results_message(self):
+        response = self.search("собака")
+        self.assertContains(response, "Найдено записей: 0")
+        self.assertContains(response, "По запросу «собака» ничего не найдено")
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ('"лес', "лес OR кот", "лес*)", "NEAR(лес", "—"):
+            with self.subTest(query=query):
+                self.search(query)
+
+    def test_empty_query_renders_form(self):
+        response = self.guest_client.get(reverse("search"))
+        self.assertIsNone(response.context["page"])
+        self.assertContains(response, 'name="q"')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.other.text = "Про котов в лесу"
+        self.other.save()
+        self.assertIn(self.other.text, self.found("лес"))
+        self.other.delete()
+        self.assertEqual(len(self.found("лес")), 2)
+
+    @override_settings(POSTS_PER_PAGE=1)
+    def test_pagination_keeps_query(self):
+        response = self.search("лес", page=2)
+        page = response.context["page"]
+        self.assertEqual(page.paginator.count, 2)
+        self.assertEqual([post.text for post in page], [self.forest.text])
+        self.assertContains(response, "?q=%D0%BB%D0%B5%D1%81&amp;page=1")
+
+    def test_rebuild_and_like_backend_agree(self):
+        """Пересобранный индекс и сканирование LIKE находят те же посты"""
+        Post.objects.filter(pk=self.other.pk).update(text="Собака в лесу")
+        self.assertEqual(get_backend().count("собака"), 0)
+        call_command("rebuild_search_index", stdout=StringIO())
+        for query in ("собака", "лесу"):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    set(get_backend().ranked_ids(query, 0, 10)),
+                    set(LikeSearchBackend().ranked_ids(query, 0, 10)))
+
+    def test_backend_follows_database_vendor(self):
+        """Таблица FTS5 есть только в SQLite, на других СУБД
+        посты сохраняются без неё"""
+        self.assertIsInstance(get_backend(), SQLiteFTSBackend)
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            self.assertIsInstance(get_backend(), LikeSearchBackend)
+        with override_settings(
+                POST_SEARCH_BACKEND="posts.search.LikeSearchBackend"):
+            self.assertIsInstance(get_backend(), LikeSearchBackend)
+
+    def test_raw_saves_are_not_indexed(self):
+        post = Post(pk=10 ** 6, text="Собака в лесу", author=self.user1,
+                    pub_date=timezone.now())
+        post.save_base(raw=True)
+        self.assertEqual(get_backend().count("собака"), 0)
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser("admin", "a@a.ru", "pass")
+        self.guest_client.force_login(admin)
+        response = self.guest_client.get(
+            reverse("admin:posts_post_changelist"), {"q": "ёлк"})
+        self.assertEqual(list(response.context["cl"].result_list),
+                         [self.tree])
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser("admin", "a@a.ru", "pass")
+        cls.group = Group.objects.create(title="ж", slug="zh")
+        authors = [User.objects.create_user(username=f"author{i}")
+                   for i in range(3)]
+        for author in authors:
+            Follow.objects.create(user=cls.admin, author=author)
+            post = Post.objects.create(text="Текст", author=author,
+                                       group=cls.group)
+            Comment.objects.create(text="Комментарий", author=author,
+                                   post=post)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, **params):
+        return self.client.get(
+            reverse(f"admin:posts_{model}_changelist"), params)
+
+    def test_rows_do_not_add_queries(self):
+        """Связанные объекты строк читаются вместе со списком"""
+        for model in ("post", "comment", "follow"):
+            with self.subTest(model=model):
+                with CaptureQueriesContext(connection) as few:
+                    self.changelist(model)
+                author = User.objects.create_user(username=f"new_{model}")
+                post = Post.objects.create(text="Ещё", author=author)
+                Comment.objects.create(text="Ещё", author=author, post=post)
+                Follow.objects.create(user=author, author=self.admin)
+                with CaptureQueriesContext(connection) as more:
+                    self.changelist(model)
+                self.assertEqual(len(more), len(few))
+
+    def test_large_table_is_not_counted(self):
+        """Для больших таблиц число строк берётся из статистики СУБД"""
+        with mock.patch("posts.paginators.estimated_count",
+                        return_value=5_000_000) as estimate:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.changelist("post")
+        estimate.assert_called_once()
+        self.assertEqual(response.context["cl"].result_count, 5_000_000)
+        self.assertFalse([query for query in queries
+                          if "COUNT(" in query["sql"]
+                          and "LIMIT" not in query["sql"]])
+
+    @override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_filtered_count_is_capped(self):
+        paginator = EstimatedCountPaginator(
+            Post.objects.filter(group=self.group), 1)
+        self.assertEqual(paginator.count, 2)
+        paginator = EstimatedCountPaginator(
+            Post.objects.filter(group=self.group), 1, start=1)
+        self.assertEqual(paginator.count, 3)
+
+    @override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_pages_beyond_count_limit_are_reachable(self):
+        """Последняя показанная страница ведёт дальше лимита"""
+        with mock.patch.object(PostAdmin, "list_per_page", 1):
+            first = self.changelist("post", pub_date__gte="2000-01-01")
+            last = self.changelist("post", pub_date__gte="2000-01-01",
+                                   p=2)
+        self.assertEqual(first.context["cl"].paginator.num_pages, 2)
+        self.assertEqual(last.status_code, 200)
+        self.assertEqual(len(last.context["cl"].result_list), 1)
+        self.assertEqual(last.context["cl"].paginator.num_pages, 3)
+
+    def test_estimate_from_sqlite_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.assertEqual(estimated_count(Post), Post.objects.count())
+
+    def test_follow_has_no_user_filter(self):
+        response = self.changelist("follow", q="author1")
+        self.assertEqual(response.context["cl"].filter_specs, [])
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+
+class BenchmarkUrlsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command("seed_data", users=20, groups=2, posts=40, comments=40,
+                     follows=4, seed=2, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+
+    def benchmark(self, name, **options):
+        path = os.path.join(self.output, name)
+        call_command("benchmark_urls", repeat=2, warmup=1, output=path,
+                     stdout=StringIO(), stderr=StringIO(), **options)
+        with open(path) as result:
+            return json.load(result)
+
+    def test_every_url_is_measured_without_side_effects(self):
+        counts = (Comment.objects.count(), Follow.objects.count())
+        run = self.benchmark("run.json")
+        names = {pattern.name for pattern in urlpatterns}
+        self.assertEqual(set(run["results"]), names)
+        for name, result in run["results"].items():
+            with self.subTest(name=name):
+                self.assertIn(result["status"], (200, 302))
+                self.assertLessEqual(result["p50"], result["p99"])
+                self.assertGreater(result["queries"], 0)
+        self.assertEqual((Comment.objects.count(), Follow.objects.count()),
+                         counts)
+
+    def test_baseline_regression_fails(self):
+        run = self.benchmark("baseline.json")
+        for result in run["results"].values():
+            result["queries"] -= 1
+        baseline = os.path.join(self.output, "fewer_queries.json")
+        with open(baseline, "w") as output:
+            json.dump(run, output)
+        with self.assertRaisesMessage(CommandError, "запросов"):
+            self.benchmark("run.json", baseline=baseline)
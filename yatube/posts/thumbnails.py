@@ -0,0 +1,396 @@
+"""Фоновая подготовка миниатюр изображений постов.
+
+Все варианты миниатюр (POST_THUMBNAILS × POST_THUMBNAIL_FORMATS) строятся
+сразу после сохранения поста с картинкой, вне потока запроса. Шаблоны
+только ищут готовую миниатюру в KV-хранилище sorl-thumbnail и, если её
+ещё нет, показывают заглушку и ставят картинку в очередь. Когда фоновый
+исполнитель достроит варианты, ленты с постами этой картинки получают
+новую версию и заглушка уходит из кеша. Картинка, которую построить
+не удалось, помечается в KV-хранилище на THUMBNAIL_FAILURE_TIMEOUT
+секунд и до тех пор в очередь не ставится.
+
+THUMBNAIL_PIPELINE выбирает исполнителя: "thread" — пул потоков
+процесса, "sync" — локальная замена очереди, выполняющая работу сразу
+(для разработки и тестов)"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.dispatch import Signal
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .cache import bump_feed_versions, post_feed_scopes
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Отправляется после каждой попытки построить вариант миниатюры:
+# geometry, fmt, duration (секунды), ok
+thumbnail_generated = Signal()
+
+_MISSING = object()
+
+
+class PostKVStore(cached_db_kvstore.KVStore):
+    """KV-хранилище sorl-thumbnail с пакетным чтением и кешем в памяти.
+
+    Найденные записи дополнительно держатся в памяти процесса
+    THUMBNAIL_LOCAL_CACHE_TIMEOUT секунд: имя миниатюры выводится из
+    имени исходника и опций, а исходники хранятся по содержимому,
+    поэтому запись под ключом не меняется. Отсутствующие записи
+    в памяти не запоминаются — их построит фоновый исполнитель"""
+
+    def __init__(self):
+        super().__init__()
+        self.local = LocMemCache("thumbnail-kvstore", {
+            "TIMEOUT": settings.THUMBNAIL_LOCAL_CACHE_TIMEOUT,
+            "OPTIONS": {"MAX_ENTRIES": settings.THUMBNAIL_LOCAL_CACHE_SIZE},
+        })
+
+    def get_many(self, image_files):
+        """Словарь {ключ файла: ImageFile} для найденных файлов —
+        не больше одного запроса к кешу и одного к базе"""
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        return {keys[raw_key]: deserialize_image_file(value)
+                for raw_key, value in self._get_many_raw(keys).items()}
+
+    def _get_many_raw(self, keys):
+        found = self.local.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if not missing:
+            return found
+        shared = self.cache.get_many(missing)
+        unknown = [key for key in missing if key not in shared]
+        if unknown:
+            rows = dict(KVStoreModel.objects.filter(
+                key__in=unknown).values_list("key", "value"))
+            self.cache.set_many(
+                rows, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+            shared.update(rows)
+        shared = {key: value for key, value in shared.items()
+                  if value != cached_db_kvstore.EMPTY_VALUE}
+        self.local.set_many(shared)
+        found.update(shared)
+        return found
+
+    def _failure_key(self, image):
+        return add_prefix(f"failed||{image.name}")
+
+    def mark_failed(self, image):
+        """Запоминает, что миниатюры картинки построить не удалось"""
+        key = self._failure_key(image)
+        self.cache.set(key, True, settings.THUMBNAIL_FAILURE_TIMEOUT)
+        self.local.set(key, True)
+
+    def clear_failed(self, image):
+        key = self._failure_key(image)
+        self.cache.delete(key)
+        self.local.delete(key)
+
+    def failed(self, image):
+        key = self._failure_key(image)
+        if self.local.get(key):
+            return True
+        if self.cache.get(key):
+            self.local.set(key, True)
+            return True
+        return False
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.local.clear()
+
+    def _get_raw(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self.local.set(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.local.delete_many(keys)
+
+
+class PostThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, умеющий искать миниатюру без генерации"""
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """Миниатюра с итоговыми опциями — так же, как её назовёт
+        get_thumbnail, но без обращения к исходному изображению"""
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault("format", self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """Готовая миниатюра из KV-хранилища или None"""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options))
+
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png",
+              "GIF": "image/gif", "WEBP": "image/webp"}
+
+
+class Picture:
+    """Готовый набор вариантов изображения для тега <picture>.
+
+    sources — пары (MIME-тип, srcset) для форматов, которые браузер
+    выберет, если поддерживает; img — миниатюра основного размера
+    в последнем (самом совместимом) формате, img_srcset — её ширины"""
+
+    def __init__(self, thumbnails, geometry):
+        formats = settings.POST_THUMBNAIL_FORMATS
+        self.sources = [(MIME_TYPES[fmt], self._srcset(thumbnails, fmt))
+                        for fmt in formats[:-1]]
+        self.img = thumbnails[geometry, formats[-1]]
+        self.img_srcset = self._srcset(thumbnails, formats[-1])
+        self.sizes = settings.POST_IMAGE_SIZES
+
+    @staticmethod
+    def _srcset(thumbnails, fmt):
+        return ", ".join(f"{thumbnail.url} {thumbnail.width}w"
+                         for (geometry, variant_format), thumbnail
+                         in thumbnails.items() if variant_format == fmt)
+
+
+def variants():
+    """Все пары (размер, формат), которые строятся для картинки поста"""
+    return [(geometry, fmt) for geometry in settings.POST_THUMBNAILS
+            for fmt in settings.POST_THUMBNAIL_FORMATS]
+
+
+def thumbnail_options(geometry, fmt=None):
+    """Опции sorl для размера из POST_THUMBNAILS и формата"""
+    options = dict(settings.POST_THUMBNAILS[geometry])
+    if fmt is not None:
+        options["format"] = fmt
+    return options
+
+
+def missing_thumbnails(image):
+    """Варианты картинки, которых ещё нет в KV-хранилище"""
+    return [(geometry, fmt) for geometry, fmt in variants()
+            if default.backend.get_cached_thumbnail(
+                image, geometry, **thumbnail_options(geometry, fmt)) is None]
+
+
+def generate_thumbnails(image, missing=None):
+    """Строит варианты картинки (по умолчанию — все настроенные).
+
+    Возвращает True, если все варианты построены без ошибок; на первой
+    ошибке построение прекращается и картинка помечается как сбойная"""
+    ok = True
+    for geometry, fmt in missing or variants():
+        started = time.perf_counter()
+        try:
+            thumbnail = default.backend.get_thumbnail(
+                image, geometry, **thumbnail_options(geometry, fmt))
+            # Нечитаемый исходник sorl не считает ошибкой: пишет в лог
+            # и возвращает миниатюру, которой нет в KV-хранилище
+            built = default.kvstore.get(thumbnail) is not None
+        except Exception:
+            built = False
+            logger.exception("Не удалось построить миниатюру %s %s для %s",
+                             geometry, fmt, image.name)
+        thumbnail_generated.send(
+            sender=None, geometry=geometry, fmt=fmt,
+            duration=time.perf_counter() - started, ok=built)
+        if not built:
+            # Без любого из вариантов <picture> не показывается,
+            # строить остальные незачем
+            ok = False
+            break
+    if ok:
+        default.kvstore.clear_failed(image)
+    else:
+        logger.error("Миниатюры %s не построены, повтор не раньше "
+                     "чем через %s с", image.name,
+                     settings.THUMBNAIL_FAILURE_TIMEOUT)
+        default.kvstore.mark_failed(image)
+    return ok
+
+
+def refresh_pages(names):
+    """Сбрасывает закешированные ленты и страницы постов с картинками
+    names: пока варианты строились, в них попадала заглушка"""
+    scopes = set()
+    posts = Post.objects.filter(image__in=names).order_by()
+    for author_id, group_id in posts.values_list(
+            "author_id", "group_id").distinct():
+        scopes.update(post_feed_scopes(author_id, group_id))
+    bump_feed_versions(*scopes)
+
+
+class ThumbnailQueue:
+    """Очередь задач на построение миниатюр.
+
+    Картинка, уже стоящая в очереди, повторно не добавляется:
+    шаблоны ставят в очередь каждую миниатюру, которую не нашли"""
+
+    def __init__(self, workers):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="thumbnails")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, image):
+        with self._lock:
+            if image.name in self._pending:
+                return
+            self._pending.add(image.name)
+        self._executor.submit(self._run, image)
+
+    def _run(self, image):
+        try:
+            if generate_thumbnails(image):
+                refresh_pages([image.name])
+        finally:
+            with self._lock:
+                self._pending.discard(image.name)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ThumbnailQueue(settings.THUMBNAIL_WORKERS)
+        return _queue
+
+
+def enqueue(image):
+    """Передаёт изображение исполнителю из THUMBNAIL_PIPELINE"""
+    if settings.THUMBNAIL_PIPELINE == "sync":
+        generate_thumbnails(image)
+    else:
+        _get_queue().submit(image)
+
+
+def schedule_thumbnails(post):
+    """Ставит миниатюры поста в очередь после фиксации транзакции"""
+    if post.image:
+        image = post.image
+        transaction.on_commit(lambda: enqueue(image))
+
+
+def _ready(image, lookup, result=_MISSING):
+    """Результат lookup(image) или None, пока варианты строятся.
+
+    result — уже известный результат поиска (например, из пакетного).
+    Если чего-то нет, в режиме "sync" всё строится сразу, иначе картинка
+    снова ставится в очередь: задача могла потеряться при перезапуске
+    воркера. Постановка откладывается до фиксации транзакции, чтобы
+    исполнитель увидел картинку в базе. Сбойные картинки не строятся
+    и не ставятся в очередь"""
+    if not image:
+        return None
+    if result is _MISSING:
+        try:
+            result = lookup(image)
+        except Exception:
+            if not default.kvstore.failed(image):
+                logger.exception("Ошибка поиска миниатюр %s", image.name)
+                default.kvstore.mark_failed(image)
+            return None
+    if result is None:
+        if default.kvstore.failed(image):
+            return None
+        if settings.THUMBNAIL_PIPELINE == "sync":
+            generate_thumbnails(image)
+            return lookup(image)
+        transaction.on_commit(lambda: enqueue(image))
+    return result
+
+
+def ready_thumbnail(image, geometry, fmt=None):
+    """Готовая миниатюра или None; отсутствующая ставится в очередь"""
+    return _ready(image, lambda image: default.backend.get_cached_thumbnail(
+        image, geometry, **thumbnail_options(geometry, fmt)))
+
+
+def _thumbnail_files(image):
+    return {(geometry, fmt): default.backend.thumbnail_file(
+        image, geometry, **thumbnail_options(geometry, fmt))
+        for geometry, fmt in variants()}
+
+
+def _picture_from(files, found):
+    thumbnails = {}
+    for variant, thumbnail_file in files.items():
+        thumbnail = found.get(thumbnail_file.key)
+        if thumbnail is None:
+            return None
+        thumbnails[variant] = thumbnail
+    return Picture(thumbnails, settings.POST_THUMBNAIL_DEFAULT)
+
+
+def _lookup_picture(image):
+    files = _thumbnail_files(image)
+    return _picture_from(files, default.kvstore.get_many(files.values()))
+
+
+def ready_picture(image):
+    """Picture со всеми вариантами картинки или None, если какого-то
+    варианта ещё нет; недостающие ставятся в очередь"""
+    return _ready(image, _lookup_picture)
+
+
+def prefetch_pictures(posts):
+    """Ищет варианты картинок всех постов страницы одним пакетом
+    и запоминает результат в post.picture"""
+    files = []
+    for post in posts:
+        if not post.image:
+            continue
+        try:
+            files.append((post, _thumbnail_files(post.image)))
+        except Exception:
+            # Битое имя файла не должно лишать картинок всю страницу
+            post.picture = _ready(post.image, _lookup_picture)
+    try:
+        found = default.kvstore.get_many(
+            thumbnail_file for post, post_files in files
+            for thumbnail_file in post_files.values())
+    except Exception:
+        logger.exception("Ошибка пакетного поиска миниатюр")
+        return
+    for post, post_files in files:
+        post.picture = _ready(post.image, _lookup_picture,
+                              _picture_from(post_files, found))
+
+
+def picture_for(post):
+    """Варианты картинки поста: из prefetch_pictures или отдельным
+    поиском, если страница их не запрашивала"""
+    if "picture" in post.__dict__:
+        return post.picture
+    return ready_picture(post.image)
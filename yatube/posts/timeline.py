@@ -0,0 +1,168 @@
+"""Материализованная лента подписок (fan-out on write).
+
+При публикации поста запись о нём раскладывается в ленты всех
+подписчиков автора, при подписке в ленту добавляются посты автора,
+при отписке — удаляются. Страница /follow/ читает только свою ленту.
+
+Авторы, у которых подписчиков больше TIMELINE_CELEBRITY_THRESHOLD,
+в ленты не раскладываются: их посты подмешиваются при чтении
+(fan-out on read), чтобы одна публикация не порождала миллионы строк.
+Когда число подписчиков опускается до порога, посты автора
+дописываются в ленты всех его подписчиков"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+
+from .models import FeedEntry, Follow, Post, UserCounters
+
+# Ключ курсорной пагинации ленты: дата и id поста из записи ленты,
+# чтобы диапазон страницы шёл по индексу FeedEntry (user, -pub_date)
+FEED_KEY = ("feed_date", "feed_post_id")
+
+
+def celebrity_ids(author_ids):
+    """Из переданных авторов выбирает тех, чьи посты читаются
+    при чтении ленты, а не раскладываются при публикации"""
+    threshold = settings.TIMELINE_CELEBRITY_THRESHOLD
+    if threshold is None:
+        return []
+    return list(UserCounters.objects.filter(
+        user_id__in=author_ids, follower_count__gt=threshold
+    ).values_list("user_id", flat=True))
+
+
+def is_celebrity(author_id):
+    return bool(celebrity_ids([author_id]))
+
+
+def _entries_for_post(post, user_ids):
+    return (FeedEntry(user_id=user_id, post_id=post.id,
+                      author_id=post.author_id, pub_date=post.pub_date)
+            for user_id in user_ids)
+
+
+def _bulk_insert(entries):
+    """Пишет записи ленты пачками, возвращает их количество"""
+    batch = []
+    total = 0
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= settings.TIMELINE_BATCH_SIZE:
+            FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+            batch = []
+    if batch:
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+    return total
+
+
+def fan_out_post(post):
+    """Добавляет новый пост в ленты всех подписчиков автора"""
+    if is_celebrity(post.author_id):
+        return 0
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list("user_id", flat=True)
+    return _bulk_insert(_entries_for_post(post, followers.iterator()))
+
+
+def backfill_follow(follow):
+    """Добавляет в ленту подписчика уже опубликованные посты автора"""
+    if is_celebrity(follow.author_id):
+        return 0
+    posts = Post.objects.filter(author_id=follow.author_id).values_list(
+        "id", "pub_date").order_by()
+    return _bulk_insert(
+        FeedEntry(user_id=follow.user_id, post_id=post_id,
+                  author_id=follow.author_id, pub_date=pub_date)
+        for post_id, pub_date in posts.iterator()
+    )
+
+
+def backfill_demoted_author(author_id):
+    """Дописывает посты автора в ленты всех его подписчиков, если
+    отписка только что опустила число подписчиков до порога: его посты
+    больше не подмешиваются при чтении. Вызывается в транзакции
+    отписки, поэтому порог пересекает ровно одна из них"""
+    threshold = settings.TIMELINE_CELEBRITY_THRESHOLD
+    if threshold is None:
+        return 0
+    follower_count = UserCounters.objects.filter(
+        user_id=author_id).values_list("follower_count", flat=True).first()
+    if follower_count != threshold:
+        return 0
+    posts = list(Post.objects.filter(author_id=author_id).values_list(
+        "id", "pub_date").order_by())
+    followers = Follow.objects.filter(
+        author_id=author_id).values_list("user_id", flat=True)
+    return _bulk_insert(
+        FeedEntry(user_id=user_id, post_id=post_id, author_id=author_id,
+                  pub_date=pub_date)
+        for user_id in followers.iterator()
+        for post_id, pub_date in posts
+    )
+
+
+def trim_follow(follow):
+    """Убирает из ленты подписчика посты автора после отписки"""
+    FeedEntry.objects.filter(user_id=follow.user_id,
+                             author_id=follow.author_id).delete()
+
+
+def rebuild_timelines(user_ids=None):
+    """Пересобирает ленты указанных пользователей (или всех)
+    по текущим подпискам. Возвращает число записанных строк.
+
+    Ленты строятся одним INSERT ... SELECT на стороне СУБД,
+    а не подпиской за подпиской: после загрузки больших объёмов
+    данных это минуты вместо часов"""
+    entries = FeedEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+
+    conditions = []
+    params = []
+    threshold = settings.TIMELINE_CELEBRITY_THRESHOLD
+    if threshold is not None:
+        conditions.append(f"f.author_id NOT IN (SELECT user_id FROM "
+                          f"{UserCounters._meta.db_table} "
+                          f"WHERE follower_count > %s)")
+        params.append(threshold)
+    if user_ids is not None:
+        if not user_ids:
+            return 0
+        conditions.append("f.user_id IN (%s)"
+                          % ", ".join(["%s"] * len(user_ids)))
+        params.extend(user_ids)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FeedEntry._meta.db_table} "
+            f"(user_id, post_id, author_id, pub_date) "
+            f"SELECT f.user_id, p.id, p.author_id, p.pub_date "
+            f"FROM {Follow._meta.db_table} f "
+            f"JOIN {Post._meta.db_table} p ON p.author_id = f.author_id"
+            f"{where}", params)
+        return cursor.rowcount
+
+
+def timeline_posts(user):
+    """Посты ленты подписок: материализованная часть плюс посты
+    популярных авторов, прочитанные напрямую. Поля FEED_KEY
+    (feed_date, feed_post_id) задают порядок ленты"""
+    followed = Follow.objects.filter(user=user).values_list(
+        "author_id", flat=True)
+    celebrities = celebrity_ids(followed)
+    if not celebrities:
+        # Поля из записи ленты берутся из того же соединения таблиц,
+        # что и условие по читателю
+        posts = Post.objects.filter(feed_entries__user=user).annotate(
+            feed_date=F("feed_entries__pub_date"),
+            feed_post_id=F("feed_entries__post_id"))
+    else:
+        entries = FeedEntry.objects.filter(user=user).values("post_id")
+        posts = Post.objects.filter(
+            Q(id__in=entries) | Q(author_id__in=celebrities)
+        ).annotate(feed_date=F("pub_date"), feed_post_id=F("id"))
+    return posts.order_by("-feed_date", "-feed_post_id")
@@ -1,66 +1,146 @@
 """Здесь собраны view-функции, реализующие основную логику проекта.
 К страницам с выводом постов подключена пагинация"""
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.http import urlencode
 
+from .cache import feed_version, follow_feed_version
+from .counters import counters_for
+from .decorators import cache_page_for_anonymous
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, User
+from .paginators import CountedPaginator, get_feed_page
+from .search import search_posts
+from .thumbnails import schedule_thumbnails
+from .timeline import FEED_KEY, timeline_posts
 
 
+def _is_following(user, author):
+    """Подписан ли текущий пользователь на автора"""
+    if not user.is_authenticated:
+        return False
+    return Follow.objects.filter(user=user, author=author).exists()
+
+
+def _newest(posts):
+    return posts.aggregate(newest=Max("pub_date"))["newest"]
+
+
+def _index_state(request):
+    return _newest(Post.objects.all()), feed_version("index")
+
+
+def _group_state(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        "id", flat=True).first()
+    if group_id is None:
+        return None
+    return (_newest(Post.objects.filter(group_id=group_id)),
+            feed_version(f"group:{group_id}"))
+
+
+def _author_state(username):
+    """Версия карточки и ленты автора: лента плюс его счётчики"""
+    author = User.objects.filter(username=username).values_list(
+        "id", "counters__post_count", "counters__follower_count",
+        "counters__following_count").first()
+    if author is None:
+        return None
+    return author[0], f"{feed_version(f'author:{author[0]}')}:{author[1:]}"
+
+
+def _profile_state(request, username):
+    author = _author_state(username)
+    if author is None:
+        return None
+    author_id, version = author
+    return _newest(Post.objects.filter(author_id=author_id)), version
+
+
+def _post_state(request, username, post_id):
+    author = _author_state(username)
+    post = Post.objects.filter(id=post_id).values_list(
+        "pub_date", "comment_count").first()
+    if author is None or post is None:
+        return None
+    newest_comment = Comment.objects.filter(post_id=post_id).aggregate(
+        newest=Max("created"))["newest"]
+    return (max(filter(None, (post[0], newest_comment))),
+            f"{author[1]}:{post[1]}")
+
+
+@cache_page_for_anonymous(_index_state)
 def index(request):
     """Отображение постов на главной странице"""
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    return render(request, "index.html", {"page": page})
+    post_list = Post.objects.select_related("author", "group")
+    page = get_feed_page(request, post_list)
+    return render(request, "index.html",
+                  {"page": page, "feed_version": feed_version("index"),
+                   "feed_cache_timeout": settings.FEED_CACHE_TIMEOUT})
 
 
+@cache_page_for_anonymous(_group_state)
 def group_posts(request, slug):
     """Отображение постов в тематических группах"""
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"groups": group, "page": page})
+    post_list = group.posts.select_related("author")
+    page = get_feed_page(request, post_list)
+    return render(request, "group.html",
+                  {"groups": group, "page": page,
+                   "feed_version": feed_version(f"group:{group.id}"),
+                   "feed_cache_timeout": settings.FEED_CACHE_TIMEOUT})
 
 
+@cache_page_for_anonymous(_profile_state)
 def profile(request, username):
     """Отображение всех постов автора"""
-    author = get_object_or_404(User, username=username)
-    author_posts = author.posts.all()
-    post_count = author_posts.count()
-    follow = Follow.objects.filter(user_id=request.user.id
-                                   ).filter(author_id=author.id)
-    paginator = Paginator(author_posts, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(User.objects.select_related("counters"),
+                               username=username)
+    counters = counters_for(author)
+    author_posts = author.posts.select_related("author", "group")
+    follow = _is_following(request.user, author)
+    page = get_feed_page(request, author_posts)
     return render(request, "profile.html",
-                  {"author": author, "post_count": post_count, "page": page,
-                   "follow": follow, }
+                  {"author": author, "counters": counters,
+                   "post_count": counters.post_count, "page": page,
+                   "follow": follow,
+                   "feed_version": feed_version(f"author:{author.id}"),
+                   "feed_cache_timeout": settings.FEED_CACHE_TIMEOUT, }
                   )
 
 
+@cache_page_for_anonymous(_post_state)
 def post_view(request, username, post_id):
     """Отображение страницы поста с комментариями к нему"""
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related("author__counters", "group"),
+        id=post_id, author__username=username)
     author = post.author
-    author_posts = author.posts.all()
-    post_count = author_posts.count()
-    follow = Follow.objects.filter(user_id=request.user.id
-                                   ).filter(author_id=author.id).exists()
+    counters = counters_for(author)
+    paginator = CountedPaginator(post.comments.select_related("author"),
+                                 settings.COMMENTS_PER_PAGE,
+                                 count=post.comment_count)
+    comments_page = paginator.get_page(request.GET.get("page"))
+    follow = _is_following(request.user, author)
     form = CommentForm(request.POST or None)
     return render(request, "post.html",
-                  {"post": post, "author": author, "post_count": post_count,
-                   "comments": comments, "form": form, "follow": follow, }
+                  {"post": post, "author": author, "counters": counters,
+                   "post_count": counters.post_count,
+                   "comments": comments_page.object_list,
+                   "comments_page": comments_page,
+                   "form": form, "follow": follow,
+                   "comments_version": feed_version(f"comments:{post.id}"),
+                   "comments_cache_timeout": settings.COMMENTS_CACHE_TIMEOUT,
+                   }
                   )
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, username, post_id):
     """Функция для добавления коментария к посту, используется с декоратором,
     проверяющим аутентификацию пользователя"""
@@ -75,6 +155,7 @@ def add_comment(request, username, post_id):
 
 
 @login_required
+@transaction.atomic
 def new_post(request):
     """Функция для создания нового поста, используется с декоратором,
     проверяющим аутентификацию пользователя"""
@@ -88,6 +169,7 @@ def new_post(request):
                                                  auto_now_add=True
                                                  )
             form.save()
+            schedule_thumbnails(post)
             return redirect("index")
 
         return render(request, "new.html", {"form": form, "context": context})
@@ -97,6 +179,7 @@ def new_post(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, username, post_id):
     """Функция для редактирования существующего поста"""
     context = {"header": "Редактировать запись", "button": "Сохранить"}
@@ -107,6 +190,8 @@ def post_edit(request, username, post_id):
                     instance=post)
     if form.is_valid():
         form.save()
+        if "image" in form.changed_data:
+            schedule_thumbnails(post)
         return redirect("post", username=username, post_id=post_id)
     return render(request, "new.html", {"form": form, "context": context,
                                         "post": post})
@@ -133,29 +218,41 @@ def server_error(request):
 def follow_index(request):
     """Функция, реализующая просмотр постов всех авторов,
     на которых подписан пользователь"""
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    return render(request, "follow.html", {"page": page})
+    post_list = timeline_posts(request.user).select_related("author",
+                                                            "group")
+    page = get_feed_page(request, post_list, FEED_KEY)
+    return render(request, "follow.html",
+                  {"page": page,
+                   "feed_version": follow_feed_version(request.user),
+                   "feed_cache_timeout": settings.FEED_CACHE_TIMEOUT})
+
+
+def search(request):
+    """Поиск постов по тексту, самые подходящие первыми"""
+    query = request.GET.get("q", "").strip()
+    page = None
+    if query:
+        paginator = Paginator(search_posts(query), settings.POSTS_PER_PAGE)
+        page = paginator.get_page(request.GET.get("page"))
+    return render(request, "search.html",
+                  {"query": query, "page": page,
+                   "page_query": urlencode({"q": query}) + "&"})
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     """Функция, реализующая механизм подписки на автора"""
-    get_object_or_404(User, username=username)
-    if request.user.username != username:
-        Follow.objects.get_or_create(user=request.user,
-                                     author=User.objects.get(
-                                         username=username))
+    author = get_object_or_404(User, username=username)
+    if request.user != author:
+        Follow.objects.get_or_create(user=request.user, author=author)
     return redirect("profile", username=username)
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     """Функция, реализующая механизм удаления подписки на автора"""
-    get_object_or_404(User, username=username)
-    Follow.objects.get(
-        user=request.user,
-        author=User.objects.get(username=username)).delete()
+    author = get_object_or_404(User, username=username)
+    Follow.objects.get(user=request.user, author=author).delete()
     return redirect("profile", username=username)
@@ -0,0 +1,289 @@
+"""Настройка кеша из окружения и собственные бэкенды кеша.
+
+CACHE_URL задаёт общий для всех воркеров кеш:
+ - locmem://                  — кеш в памяти процесса (по умолчанию);
+ - redis://host:6379/0        — Redis, нужен пакет django-redis;
+ - memcached://host:11211     — memcached, нужен пакет python-memcached;
+ - file:///var/tmp/yatube     — файловый кеш Django;
+ - sqlite:///var/tmp/cache.db — SQLiteCache: общий кеш для воркеров
+   одного сервера без отдельного сервиса.
+
+Общий кеш оборачивается в TwoTierCache: неизменяемые «горячие» ключи
+(фрагменты шаблонов с версией ленты в ключе) дополнительно держатся
+в памяти процесса CACHE_L1_TIMEOUT секунд.
+
+Файлы file:// и sqlite:// задаются абсолютным путём (три косые черты)"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+# Префиксы ключей фрагментов {% cache %} и страниц для анонимов, в которые
+# входит версия данных: содержимое под таким ключом не меняется, и его
+# можно держать в L1. Фрагмент без версии в ключе сбрасывается удалением,
+# а удаление очищает L1 только своего процесса, поэтому такие фрагменты
+# сюда не добавляются
+HOT_KEY_PREFIXES = tuple(
+    f"template.cache.{fragment}." for fragment in (
+        "index_page", "group_page", "profile_page", "follow_page",
+        "post_comments")
+) + ("anon-page:",)
+
+# Раз во сколько записей SQLiteCache удаляет просроченные ключи
+CULL_EVERY = 100
+
+_MISSING = object()
+
+
+def _absolute_path(url, parts):
+    # В file://cache.db имя файла разбирается как хост, а путь пуст:
+    # кеш молча ушёл бы во временный файл
+    if parts.netloc or not parts.path.startswith("/"):
+        raise ValueError(f"В CACHE_URL нужен абсолютный путь "
+                         f"({parts.scheme}:///var/tmp/...): {url}")
+    return parts.path
+
+
+def caches_from_url(url, l1_timeout=0):
+    """Строит словарь CACHES по строке подключения"""
+    parts = urlsplit(url)
+    scheme = parts.scheme
+    if scheme == "locmem":
+        return {"default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }}
+    if scheme == "redis":
+        shared = {"BACKEND": "django_redis.cache.RedisCache",
+                  "LOCATION": url}
+    elif scheme == "memcached":
+        shared = {
+            "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+            "LOCATION": parts.netloc.split(","),
+        }
+    elif scheme == "file":
+        shared = {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": _absolute_path(url, parts),
+        }
+    elif scheme == "sqlite":
+        shared = {"BACKEND": "yatube.cache_backends.SQLiteCache",
+                  "LOCATION": _absolute_path(url, parts)}
+    else:
+        raise ValueError(f"Неизвестная схема CACHE_URL: {url}")
+    if not l1_timeout:
+        return {"default": shared}
+    return {
+        "default": {
+            "BACKEND": "yatube.cache_backends.TwoTierCache",
+            "OPTIONS": {"L2": shared, "L1_TIMEOUT": l1_timeout},
+        },
+    }
+
+
+class SQLiteCache(BaseCache):
+    """Кеш в файле SQLite, общий для всех процессов одного сервера.
+
+    Файл открывается в режиме WAL: чтения не блокируют запись,
+    а запись из разных воркеров сериализуется самой SQLite"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def _db(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires)")
+            self._local.connection = connection
+        return connection
+
+    def _expiry(self, timeout):
+        # Для BaseCache это уже абсолютное время истечения или None
+        return self.get_backend_timeout(timeout)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _alive(self, key):
+        row = self._db.execute(
+            "SELECT value FROM cache WHERE key = ? AND "
+            "(expires IS NULL OR expires > ?)", (key, time.time())).fetchone()
+        return _MISSING if row is None else pickle.loads(row[0])
+
+    def _write(self, key, value, timeout):
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) "
+            "VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+             self._expiry(timeout)))
+        self._writes += 1
+        if self._writes % CULL_EVERY == 0:
+            self._cull()
+
+    def _cull(self):
+        db = self._db
+        db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        (count,) = db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self._max_entries and self._cull_frequency:
+            db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "ORDER BY expires IS NULL, expires LIMIT ?)",
+                (count // self._cull_frequency,))
+
+    def get(self, key, default=None, version=None):
+        value = self._alive(self._key(key, version))
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write(self._key(key, version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._alive(key) is not _MISSING:
+                return False
+            self._write(key, value, timeout)
+            return True
+        finally:
+            db.execute("COMMIT")
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            value = self._alive(key)
+            if value is _MISSING:
+                raise ValueError(f"Key '{key}' not found")
+            db.execute(
+                "UPDATE cache SET value = ? WHERE key = ?",
+                (pickle.dumps(value + delta, pickle.HIGHEST_PROTOCOL), key))
+            return value + delta
+        finally:
+            db.execute("COMMIT")
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._db.execute(
+            "UPDATE cache SET expires = ? WHERE key = ? AND "
+            "(expires IS NULL OR expires > ?)",
+            (self._expiry(timeout), self._key(key, version), time.time()))
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        self._db.execute("DELETE FROM cache WHERE key = ?",
+                         (self._key(key, version),))
+
+    def has_key(self, key, version=None):
+        return self._alive(self._key(key, version)) is not _MISSING
+
+    def clear(self):
+        self._db.execute("DELETE FROM cache")
+
+
+class TwoTierCache(BaseCache):
+    """Общий кеш (L2) с кешем в памяти процесса (L1) для горячих ключей.
+
+    В L1 попадают только ключи с префиксами из L1_PREFIXES — по умолчанию
+    версионированные фрагменты шаблонов и страницы для анонимов, которые
+    не меняются под одним и тем же ключом (см. HOT_KEY_PREFIXES).
+    Счётчики версий лент и прочие изменяемые значения читаются из L2"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        l2 = dict(options["L2"])
+        backend = import_string(l2.pop("BACKEND"))
+        self._l2 = backend(l2.pop("LOCATION", ""), l2)
+        self._l1 = LocMemCache(f"l1-{id(self)}", {
+            "TIMEOUT": options.get("L1_TIMEOUT", 5),
+            "OPTIONS": {"MAX_ENTRIES": options.get("L1_MAX_ENTRIES", 1000)},
+        })
+        self._l1_prefixes = tuple(options.get(
+            "L1_PREFIXES", HOT_KEY_PREFIXES))
+
+    def _is_hot(self, key):
+        return key.startswith(self._l1_prefixes)
+
+    def get(self, key, default=None, version=None):
+        if not self._is_hot(key):
+            return self._l2.get(key, default, version)
+        value = self._l1.get(key, version=version)
+        if value is None:
+            value = self._l2.get(key, version=version)
+            if value is not None:
+                self._l1.set(key, value, version=version)
+        return default if value is None else value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        shared = []
+        for key in keys:
+            value = self._l1.get(key, version=version) \
+                if self._is_hot(key) else None
+            if value is None:
+                shared.append(key)
+            else:
+                found[key] = value
+        if shared:
+            found.update(self._l2.get_many(shared, version=version))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l2.set(key, value, timeout, version)
+        if self._is_hot(key):
+            self._l1.set(key, value, version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._l2.add(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._l2.set_many(data, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._l2.incr(key, delta, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._l2.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        # L1 других процессов догонит L2 не позже чем через L1_TIMEOUT
+        self._l1.delete(key, version)
+        self._l2.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        self._l1.delete_many(keys, version)
+        self._l2.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self._l2.has_key(key, version)
+
+    def clear(self):
+        self._l1.clear()
+        self._l2.clear()
+
+    def close(self, **kwargs):
+        self._l2.close(**kwargs)
@@ -0,0 +1,318 @@
+"""Замер запросов: время ответа, SQL, шаблоны и кеш.
+
+RequestMetricsMiddleware считает для каждого запроса время ответа,
+число и время SQL-запросов, время отрисовки шаблонов, попадания
+и промахи кеша. Итоги уходят в заголовок Server-Timing (видны
+в инструментах разработчика браузера; посетителям, кроме сотрудников,
+только при SERVER_TIMING) и в гистограммы по имени URL,
+которые отдаёт request_stats. Гистограммы свои у каждого процесса
+и сбрасываются при его перезапуске; сумма по всем воркерам
+для Prometheus — в metrics.py.
+
+Время шаблонов включает SQL ленивых выборок, выполненных
+при отрисовке, поэтому оно пересекается со временем SQL"""
+import functools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.db import connections
+from django.http import JsonResponse
+from django.template.backends.django import Template
+from django.utils import timezone
+
+from yatube import metrics as prometheus
+
+# Верхние границы корзин гистограмм: время в мс и число SQL-запросов
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Ключи фрагментов {% cache имя ... %}: template.cache.<имя>.<хеш>
+FRAGMENT_PREFIX = "template.cache."
+
+_MISSING = object()
+_local = threading.local()
+
+
+def current_metrics():
+    """Замер текущего запроса или None вне запроса"""
+    return getattr(_local, "metrics", None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (имя фрагмента, "hit" или "miss") -> число чтений
+        self.fragments = Counter()
+        # Вложенные вызовы (include в шаблоне, L1 внутри TwoTierCache)
+        # уже входят во внешний и не считаются второй раз
+        self.rendering = False
+        self.in_cache = False
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_time += time.perf_counter() - started
+
+    def server_timing(self, elapsed):
+        return ", ".join((
+            f"app;dur={elapsed * 1000:.1f}",
+            f'db;dur={self.sql_time * 1000:.1f};desc="SQL: '
+            f'{self.sql_count}"',
+            f"tpl;dur={self.template_time * 1000:.1f}",
+            f'cache;desc="hit {self.cache_hits}, '
+            f'miss {self.cache_misses}"',
+        ))
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, share):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = share * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def as_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class RouteStats:
+    def __init__(self):
+        self.time = Histogram(TIME_BUCKETS)
+        self.sql_time = Histogram(TIME_BUCKETS)
+        self.template_time = Histogram(TIME_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.errors = 0
+
+    def record(self, metrics, elapsed, status):
+        self.time.observe(elapsed * 1000)
+        self.sql_time.observe(metrics.sql_time * 1000)
+        self.template_time.observe(metrics.template_time * 1000)
+        self.queries.observe(metrics.sql_count)
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+        if status >= 500:
+            self.errors += 1
+
+    def as_dict(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "time_ms": self.time.as_dict(),
+            "sql_time_ms": self.sql_time.as_dict(),
+            "template_time_ms": self.template_time.as_dict(),
+            "queries": self.queries.as_dict(),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_ratio": (round(self.cache_hits / lookups, 3)
+                                if lookups else None),
+            "errors": self.errors,
+        }
+
+
+_routes = {}
+_routes_lock = threading.Lock()
+_started = timezone.now()
+
+
+def record(route, metrics, elapsed, status):
+    with _routes_lock:
+        stats = _routes.get(route)
+        if stats is None:
+            stats = _routes[route] = RouteStats()
+        stats.record(metrics, elapsed, status)
+
+
+def snapshot():
+    with _routes_lock:
+        routes = {route: stats.as_dict()
+                  for route, stats in sorted(_routes.items())}
+    return {"pid": os.getpid(), "since": _started.isoformat(),
+            "routes": routes}
+
+
+def reset():
+    with _routes_lock:
+        _routes.clear()
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, *args, **kwargs):
+        metrics = current_metrics()
+        if metrics is None or metrics.rendering:
+            return render(self, *args, **kwargs)
+        metrics.rendering = True
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.rendering = False
+            metrics.template_time += time.perf_counter() - started
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _counted_get(get):
+    @functools.wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        metrics = current_metrics()
+        if metrics is None or metrics.in_cache:
+            return get(self, key, default, version)
+        metrics.in_cache = True
+        try:
+            value = get(self, key, _MISSING, version)
+        finally:
+            metrics.in_cache = False
+        hit = value is not _MISSING
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+        if isinstance(key, str) and key.startswith(FRAGMENT_PREFIX):
+            fragment = key[len(FRAGMENT_PREFIX):].rsplit(".", 1)[0]
+            metrics.fragments[fragment, "hit" if hit else "miss"] += 1
+        return value if hit else default
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @functools.wraps(get_many)
+    def wrapper(self, keys, version=None):
+        metrics = current_metrics()
+        if metrics is None or metrics.in_cache:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        metrics.in_cache = True
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            metrics.in_cache = False
+        metrics.cache_hits += len(found)
+        metrics.cache_misses += len(keys) - len(found)
+        return found
+    wrapper.instrumented = True
+    return wrapper
+
+
+def install():
+    """Оборачивает отрисовку шаблонов и чтение из кешей из CACHES.
+
+    Хуков для этого в Django нет, поэтому методы подменяются один раз
+    на уровне классов; вне запроса обёртки сразу вызывают исходный
+    метод"""
+    if not getattr(Template.render, "instrumented", False):
+        Template.render = _timed_render(Template.render)
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if not getattr(backend.get, "instrumented", False):
+            backend.get = _counted_get(backend.get)
+        if not getattr(backend.get_many, "instrumented", False):
+            backend.get_many = _counted_get_many(backend.get_many)
+
+
+def route_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None or not match.url_name:
+        return "<unresolved>"
+    return match.view_name
+
+
+def show_server_timing(request):
+    """Заголовок раскрывает число и время SQL-запросов, поэтому
+    в боевом окружении он виден только сотрудникам"""
+    if settings.SERVER_TIMING:
+        return True
+    user = getattr(request, "user", None)
+    return user is not None and user.is_staff
+
+
+class RequestMetricsMiddleware:
+    """Стоит первым в MIDDLEWARE, чтобы время ответа включало
+    остальные middleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+        prometheus.install()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        _local.metrics = metrics
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        elapsed = time.perf_counter() - started
+        route = route_name(request)
+        record(route, metrics, elapsed, response.status_code)
+        prometheus.observe_request(route, metrics, elapsed,
+                                   response.status_code)
+        if show_server_timing(request):
+            response["Server-Timing"] = metrics.server_timing(elapsed)
+        return response
+
+
+@staff_member_required
+def request_stats(request):
+    """Гистограммы по именам URL этого процесса"""
+    return JsonResponse(snapshot(), json_dumps_params={
+        "ensure_ascii": False, "indent": 2})
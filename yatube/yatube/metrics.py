@@ -0,0 +1,315 @@
+"""Метрики приложения в текстовом формате Prometheus.
+
+Счётчики и гистограммы копятся в памяти процесса. Если задан
+METRICS_DIR, каждый процесс не реже чем раз в METRICS_FLUSH_INTERVAL
+секунд сохраняет их в свой файл <pid>.json, а metrics_view складывает
+файлы всех живых процессов: один адрес на сервер отдаёт сумму по всем
+воркерам WSGI. Файлы завершившихся воркеров удаляются при чтении,
+поэтому после перезапуска воркера сумма уменьшается — Prometheus
+считает это сбросом счётчика, и rate()/increase() его учитывают.
+Остальные файлы в каталоге не читаются. Без METRICS_DIR отдаются
+метрики одного процесса (runserver, тесты).
+
+Адрес выключен (404), пока не задан METRICS_TOKEN; с токеном Prometheus
+передаёт заголовок Authorization: Bearer <токен>.
+
+Запросы измеряет RequestMetricsMiddleware (см. instrumentation.py),
+остальное приходит сигналами"""
+import atexit
+import hmac
+import json
+import os
+import threading
+import weakref
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save
+from django.http import Http404, HttpResponse
+
+from posts.models import Comment, Follow, Post
+from posts.thumbnails import thumbnail_generated
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+THUMBNAIL_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Имя -> (тип, описание, границы корзин гистограммы)
+METRICS = {
+    "yatube_http_request_duration_seconds": (
+        "histogram", "Время ответа по имени URL", LATENCY_BUCKETS),
+    "yatube_http_requests_total": (
+        "counter", "Ответы по имени URL и классу статуса", None),
+    "yatube_db_queries_total": (
+        "counter", "SQL-запросы по имени URL", None),
+    "yatube_db_query_seconds_total": (
+        "counter", "Время SQL-запросов по имени URL", None),
+    "yatube_db_connections_created_total": (
+        "counter", "Соединения с базой, открытые с запуска", None),
+    "yatube_db_connections_open": (
+        "gauge", "Соединения с базой, открытые сейчас", None),
+    "yatube_fragment_cache_lookups_total": (
+        "counter", "Чтения фрагментов {% cache %}: hit или miss", None),
+    "yatube_thumbnail_generation_seconds": (
+        "histogram", "Время построения миниатюры", THUMBNAIL_BUCKETS),
+    "yatube_thumbnail_failures_total": (
+        "counter", "Миниатюры, которые не удалось построить", None),
+    "yatube_objects_created_total": (
+        "counter", "Созданные посты, комментарии и подписки", None),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Пустой реестр; вызывается и в дочернем процессе после fork,
+        чтобы воркер не унаследовал значения родителя"""
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (имя, метки) -> [число в каждой корзине и в +Inf, сумма]
+        self.histograms = {}
+        self.flush_scheduled = False
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self._changed()
+
+    def observe(self, name, value, **labels):
+        bounds = METRICS[name][2]
+        key = (name, _key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(bounds) + 2)
+            index = 0
+            while index < len(bounds) and value > bounds[index]:
+                index += 1
+            histogram[index] += 1
+            histogram[-1] += value
+        self._changed()
+
+    def dump(self):
+        with self.lock:
+            return {
+                "counters": [[name, dict(labels), value] for
+                             (name, labels), value in self.counters.items()],
+                "histograms": [[name, dict(labels), list(values)] for
+                               (name, labels), values in
+                               self.histograms.items()],
+                "gauges": open_connections(),
+            }
+
+    def _changed(self):
+        if not settings.METRICS_DIR:
+            return
+        with self.lock:
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        timer = threading.Timer(settings.METRICS_FLUSH_INTERVAL, self.flush)
+        timer.daemon = True
+        timer.start()
+
+    def flush(self):
+        """Сохраняет метрики процесса в METRICS_DIR/<pid>.json"""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        with self.lock:
+            self.flush_scheduled = False
+        data = json.dumps(self.dump())
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        # Читатель видит либо старый файл, либо новый целиком
+        with open(path + ".tmp", "w") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+
+
+# Обёртки соединений всех потоков процесса; закрытое соединение
+# остаётся обёрткой с connection = None
+_connections = weakref.WeakSet()
+
+
+def open_connections():
+    """Мгновенные значения: открытые соединения процесса по алиасам"""
+    counts = Counter(wrapper.alias for wrapper in list(_connections)
+                     if wrapper.connection is not None)
+    return [["yatube_db_connections_open", {"alias": alias}, count]
+            for alias, count in counts.items()]
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry.reset)
+atexit.register(registry.flush)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_dumps(directory):
+    """Метрики живых процессов; файлы завершившихся удаляются"""
+    dumps = []
+    for name in os.listdir(directory):
+        pid, extension = os.path.splitext(name)
+        if extension != ".json" or not pid.isdigit():
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if not _alive(int(pid)):
+                os.remove(path)
+                continue
+            with open(path) as file:
+                dumps.append(json.load(file))
+        except (OSError, ValueError):
+            # Файл удалил другой воркер или он ещё не дописан
+            continue
+    return dumps
+
+
+def collect():
+    """Сумма метрик всех процессов: (счётчики и мгновенные значения,
+    гистограммы)"""
+    if settings.METRICS_DIR:
+        registry.flush()
+        dumps = _read_dumps(settings.METRICS_DIR)
+    else:
+        dumps = [registry.dump()]
+
+    counters = {}
+    histograms = {}
+    for dump in dumps:
+        for name, labels, value in dump["counters"] + dump.get("gauges", []):
+            key = (name, _key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in dump["histograms"]:
+            key = (name, _key(labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                total[index] += value
+    return counters, histograms
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _escape(value):
+    return (str(value).replace("\\", r"\\").replace('"', r'\"')
+            .replace("\n", r"\n"))
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def render(counters, histograms):
+    """Текстовый формат экспорта Prometheus 0.0.4"""
+    lines = []
+    for name, (kind, description, bounds) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind in ("counter", "gauge"):
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds + ("+Inf",), values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} "
+                             f"{_number(cumulative)}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} "
+                         f"{_number(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+def observe_request(route, metrics, elapsed, status):
+    """Итоги запроса из RequestMetricsMiddleware"""
+    registry.observe("yatube_http_request_duration_seconds", elapsed,
+                     view=route)
+    registry.inc("yatube_http_requests_total", view=route,
+                 status=f"{status // 100}xx")
+    registry.inc("yatube_db_queries_total", metrics.sql_count, view=route)
+    registry.inc("yatube_db_query_seconds_total", metrics.sql_time,
+                 view=route)
+    for (fragment, result), count in metrics.fragments.items():
+        registry.inc("yatube_fragment_cache_lookups_total", count,
+                     fragment=fragment, result=result)
+
+
+def _count_connection(sender, connection, **kwargs):
+    _connections.add(connection)
+    registry.inc("yatube_db_connections_created_total",
+                 alias=connection.alias)
+
+
+def _count_created(sender, instance, created, raw=False, **kwargs):
+    # Только зафиксированные строки: откаченные транзакции
+    # (ошибки, замеры benchmark_urls) не считаются
+    if created and not raw:
+        model = sender._meta.model_name
+        transaction.on_commit(lambda: registry.inc(
+            "yatube_objects_created_total", model=model))
+
+
+def _time_thumbnail(sender, geometry, fmt, duration, ok, **kwargs):
+    if ok:
+        registry.observe("yatube_thumbnail_generation_seconds", duration,
+                         size=geometry, format=fmt)
+    else:
+        registry.inc("yatube_thumbnail_failures_total", size=geometry,
+                     format=fmt)
+
+
+def install():
+    # Соединения, открытые до подключения сигнала
+    for connection in connections.all():
+        if connection.connection is not None:
+            _connections.add(connection)
+    connection_created.connect(_count_connection,
+                               dispatch_uid="metrics-connections")
+    for model in (Post, Comment, Follow):
+        post_save.connect(_count_created, sender=model,
+                          dispatch_uid=f"metrics-created-{model.__name__}")
+    thumbnail_generated.connect(_time_thumbnail,
+                                dispatch_uid="metrics-thumbnails")
+
+
+def metrics_view(request):
+    """Метрики для Prometheus; без METRICS_TOKEN адрес выключен"""
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    expected = f"Bearer {token}".encode()
+    received = request.META.get("HTTP_AUTHORIZATION", "").encode()
+    if not hmac.compare_digest(received, expected):
+        raise PermissionDenied
+    return HttpResponse(render(*collect()), content_type=CONTENT_TYPE)
@@ -0,0 +1,171 @@
+"""Поиск лишних SQL-запросов на стенде: повторов и медленных запросов.
+
+Включается переменной окружения QUERY_INSPECTOR=1. Тогда
+QueryInspectorMiddleware записывает все SQL-запросы каждого запроса
+вместе со стеком вызовов в коде проекта и отмечает:
+ - повторы — тот же SQL с теми же параметрами (лишний поход в базу);
+ - однотипные — тот же SQL с разными параметрами, не меньше
+   QUERY_INSPECTOR_SIMILAR раз (запросы в цикле, N+1);
+ - медленные — дольше SLOW_QUERY_MS.
+Пакеты executemany (один SQL на много наборов параметров) проверяются
+только на медленность: параметры пакета не сохраняются, и разные пакеты
+выглядели бы повторами.
+Запросы с находками дописываются строкой JSON в QUERY_REPORT_FILE,
+сводку по файлу печатает команда query_report.
+
+Стек снимается для каждого SQL-запроса, это заметно замедляет ответы,
+поэтому в боевом окружении детектор выключен"""
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict
+from collections.abc import Mapping
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+from yatube import instrumentation
+from yatube.instrumentation import route_name
+
+logger = logging.getLogger(__name__)
+
+# Сколько ближайших к запросу кадров стека сохранять и сколько
+# разных стеков одной находки показывать
+STACK_DEPTH = 6
+MAX_STACKS = 3
+
+_report_lock = threading.Lock()
+# Кадры middleware замеров есть в стеке каждого запроса и ничего
+# не говорят о том, откуда он пришёл
+_SKIPPED_FILES = {__file__, instrumentation.__file__}
+
+
+def project_stack():
+    """Кадры стека из кода проекта (без Django, библиотек
+    и самого детектора), от внешнего к внутреннему"""
+    frames = []
+    for frame in traceback.extract_stack():
+        path = os.path.relpath(frame.filename, settings.BASE_DIR)
+        if (path.startswith(("..", "<")) or "site-packages" in path
+                or frame.filename in _SKIPPED_FILES):
+            continue
+        frames.append([path, frame.lineno, frame.name, frame.line])
+    return frames[-STACK_DEPTH:]
+
+
+def _params(params, many):
+    """Параметры запроса строками; именованные — парами имя=значение"""
+    if many or not params:
+        return []
+    if isinstance(params, Mapping):
+        return [f"{name}={value}" for name, value in sorted(params.items())]
+    return [str(value) for value in params]
+
+
+class QueryLog:
+    """SQL-запросы одного HTTP-запроса"""
+
+    def __init__(self):
+        self.queries = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries.append({
+                "sql": sql,
+                "params": _params(params, many),
+                "many": many,
+                "time_ms": round(duration * 1000, 3),
+                "stack": project_stack(),
+            })
+
+    def findings(self, slow_ms, similar_threshold):
+        exact = defaultdict(list)
+        similar = defaultdict(list)
+        for query in self.queries:
+            if query["many"]:
+                continue
+            exact[query["sql"], tuple(query["params"])].append(query)
+            similar[query["sql"]].append(query)
+
+        found = [_finding("duplicate", group)
+                 for group in exact.values() if len(group) > 1]
+        for group in similar.values():
+            variants = {tuple(query["params"]) for query in group}
+            if len(variants) > 1 and len(group) >= similar_threshold:
+                found.append(_finding("similar", group))
+        found += [_finding("slow", [query]) for query in self.queries
+                  if query["time_ms"] >= slow_ms]
+        return found
+
+
+def _finding(kind, queries):
+    stacks = []
+    for query in queries:
+        if query["stack"] not in stacks:
+            stacks.append(query["stack"])
+    return {
+        "kind": kind,
+        "sql": queries[0]["sql"],
+        "params": queries[0]["params"],
+        "count": len(queries),
+        "time_ms": round(sum(query["time_ms"] for query in queries), 3),
+        "stacks": stacks[:MAX_STACKS],
+    }
+
+
+def write_report(entry):
+    path = settings.QUERY_REPORT_FILE
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = json.dumps(entry, ensure_ascii=False)
+    with _report_lock, open(path, "a", encoding="utf-8") as report:
+        report.write(line + "\n")
+
+
+class QueryInspectorMiddleware:
+    """Стоит первым в MIDDLEWARE: его обёртка SQL-запросов внешняя,
+    и снятие стека не входит во время запросов в RequestMetrics"""
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTOR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(log.execute_wrapper))
+            response = self.get_response(request)
+        findings = log.findings(settings.SLOW_QUERY_MS,
+                                settings.QUERY_INSPECTOR_SIMILAR)
+        if findings:
+            route = route_name(request)
+            logger.warning(
+                "%s %s (%s): %s", request.method, request.path, route,
+                ", ".join(f"{finding['kind']} x{finding['count']}"
+                          for finding in findings))
+            write_report({
+                "time": timezone.now().isoformat(),
+                "method": request.method,
+                "path": request.path,
+                "route": route,
+                "status": response.status_code,
+                "queries": len(log.queries),
+                "sql_ms": round(sum(query["time_ms"]
+                                    for query in log.queries), 3),
+                "findings": findings,
+            })
+        return response
@@ -0,0 +1,273 @@
+"""Раздача медиа- и статических файлов.
+
+FILE_SERVING выбирает способ отдачи тела файла:
+ - django     — FileResponse; WSGI-сервер с wsgi.file_wrapper (gunicorn)
+                отдаёт файл через sendfile(), Range обрабатывает Django;
+ - x-accel    — пустой ответ с X-Accel-Redirect, файл отдаёт nginx
+                из internal-локации FILE_SERVING_INTERNAL_PREFIX;
+ - x-sendfile — пустой ответ с X-Sendfile (Apache, lighttpd);
+ - off        — Django файлы не раздаёт, их отдаёт веб-сервер.
+
+Во всех режимах проверки существования файла, ETag/Last-Modified
+и условные запросы (304) выполняются здесь. Файлы с хешем содержимого
+в имени (статика после collectstatic, картинки постов и миниатюры)
+кешируются клиентами на год без перепроверки"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Имя заканчивается хешем содержимого: "app.3f2a9c1b7e04.css",
+# "posts/ab/<sha256>.jpg", "cache/0d/b0/<md5>.jpg"
+HASHED_NAME = re.compile(r"(^|[./])[0-9a-f]{12,}\.[^./]+$")
+
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Кусок, которым Django читает файл, если сервер не умеет sendfile
+BLOCK_SIZE = 64 * 1024
+
+# Текстовые файлы, для которых collectstatic готовит сжатые копии
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html",
+                           ".xml", ".map"}
+
+# Сжатые копии рядом с файлом в порядке предпочтения: name.css.br, .gz
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def available_encodings():
+    return [(encoding, suffix) for encoding, suffix in PRECOMPRESSED
+            if encoding != "br" or brotli is not None]
+
+
+class ManifestStorage(ManifestStaticFilesStorage):
+    """Статика с хешем содержимого в именах файлов и сжатыми копиями.
+
+    collectstatic кладёт рядом с каждым текстовым файлом его копии
+    в brotli (если установлен пакет brotli) и gzip, если они заметно
+    меньше. Пока collectstatic не запускался (разработка, тесты),
+    ссылки ведут на файлы без хеша, а не падают с ошибкой"""
+
+    manifest_strict = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None:
+                raise
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(paths) | set(self.hashed_files.values()):
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                self.precompress(name)
+
+    def precompress(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        for encoding, suffix in available_encodings():
+            compressed = compress(data, encoding)
+            if len(compressed) >= len(data) * 0.95:
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
+
+
+class FileRange:
+    """Файловый объект, читающий только байты [start, start + length)"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """(начало, длина) из заголовка Range, None — отдать весь файл,
+    ValueError — диапазон за пределами файла.
+
+    Поддерживается один диапазон; несколько диапазонов в одном
+    запросе RFC 7233 разрешает игнорировать и отдавать файл целиком"""
+    match = RANGE_HEADER.match(header.replace(" ", ""))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = min(int(last), size)
+        if not length:
+            raise ValueError(header)
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end - start + 1
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.META.get("HTTP_IF_RANGE")
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00",
+                                           "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _precompressed(request, full_path):
+    """Путь к сжатой копии файла, которую принимает клиент, и её
+    кодировка; (full_path, None), если подходящей копии нет"""
+    accepted = _accepted_encodings(request)
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in accepted and os.path.isfile(full_path + suffix):
+            return full_path + suffix, encoding
+    return full_path, None
+
+
+def serve_file(request, path, root_setting, internal_location=""):
+    """Отдаёт файл path из каталога, заданного настройкой root_setting"""
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        full_path = safe_join(getattr(settings, root_setting), path)
+    except SuspiciousFileOperation:
+        raise Http404("Файл не найден")
+    if not os.path.isfile(full_path):
+        raise Http404("Файл не найден")
+
+    content_type, content_encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+    compressible = (os.path.splitext(path)[1] in COMPRESSIBLE_EXTENSIONS
+                    and settings.FILE_SERVING == "django")
+    file_path = full_path
+    if compressible:
+        # Для x-accel сжатые копии выбирает nginx (gzip_static/brotli_static)
+        file_path, encoding = _precompressed(request, full_path)
+        content_encoding = encoding or content_encoding
+
+    stat = os.stat(file_path)
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, file_path, path, stat,
+                                  internal_location, etag, last_modified,
+                                  content_type)
+        if content_encoding:
+            response["Content-Encoding"] = content_encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if compressible:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    if HASHED_NAME.search(path):
+        patch_cache_control(response, public=True, immutable=True,
+                            max_age=settings.FILE_SERVING_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def _file_response(request, file_path, path, stat, internal_location,
+                   etag, last_modified, content_type):
+    mode = settings.FILE_SERVING
+
+    if mode == "x-accel":
+        # Range и отдачу тела выполняет nginx
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = quote(
+            settings.FILE_SERVING_INTERNAL_PREFIX + internal_location + path)
+        return response
+    if mode == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = file_path
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if ("HTTP_RANGE" in request.META
+            and _if_range_matches(request, etag, last_modified)):
+        try:
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    file = open(file_path, "rb")
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response["Content-Length"] = size
+    else:
+        start, length = byte_range
+        response = FileResponse(FileRange(file, start, length),
+                                content_type=content_type, status=206)
+        response["Content-Length"] = length
+        response["Content-Range"] = (
+            f"bytes {start}-{start + length - 1}/{size}")
+    response.block_size = BLOCK_SIZE
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def file_urls():
+    """URL-шаблоны раздачи MEDIA_URL и STATIC_URL (пусто в режиме off)"""
+    if settings.FILE_SERVING == "off":
+        return []
+    mounts = (
+        (settings.MEDIA_URL, "MEDIA_ROOT", "media/"),
+        (settings.STATIC_URL, "STATIC_ROOT", "static/"),
+    )
+    return [
+        re_path(r"^%s(?P<path>.*)$" % re.escape(url.lstrip("/")), serve_file,
+                {"root_setting": root, "internal_location": location})
+        for url, root, location in mounts
+    ]
@@ -19,12 +19,16 @@ import mimetypes
 
 
 from sentry_sdk.integrations.django import DjangoIntegration
+
+from yatube.cache_backends import caches_from_url
 # env = environ.Env()
 # environ.Env.read_env()
 
+# Доля запросов, для которых Sentry собирает трассировку (0 — выключено)
 sentry_sdk.init(
     dsn="https://1cc37e1b834e4a748c76962606823c8a@o1029264.ingest.sentry.io/5996184",
     integrations=[DjangoIntegration()],
+    traces_sample_rate=float(os.environ.get("SENTRY_TRACES_SAMPLE_RATE", 0)),
 )
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -73,6 +77,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Включается только при QUERY_INSPECTOR=1 (см. ниже)
+    'yatube.query_inspector.QueryInspectorMiddleware',
+    # Время ответа включает все остальные middleware
+    'yatube.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -157,10 +165,24 @@ USE_TZ = False
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# Сторонние библиотеки (Bootstrap) лежат в static/vendor, а не на CDN
+STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+# collectstatic добавляет к именам файлов хеш содержимого и готовит
+# сжатые копии .gz и .br (brotli — если установлен пакет brotli)
+STATICFILES_STORAGE = "yatube.serving.ManifestStorage"
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Раздача MEDIA_URL и STATIC_URL (см. yatube/serving.py): "django",
+# "x-accel" (nginx), "x-sendfile" (Apache) или "off" — файлы отдаёт
+# веб-сервер без участия Django
+FILE_SERVING = os.environ.get("FILE_SERVING", "django")
+FILE_SERVING_INTERNAL_PREFIX = os.environ.get(
+    "FILE_SERVING_INTERNAL_PREFIX", "/protected/")
+# Время кеширования файлов с хешем содержимого в имени
+FILE_SERVING_MAX_AGE = 60 * 60 * 24 * 365
+
 # Login
 
 LOGIN_URL = "/auth/login/"
@@ -170,8 +192,108 @@ LOGOUT_REDIRECT_URL = "index"
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+# Кеш задаётся строкой подключения CACHE_URL (см. yatube/cache_backends.py),
+# горячие ключи дополнительно держатся в памяти воркера CACHE_L1_TIMEOUT сек.
+CACHES = caches_from_url(
+    os.environ.get("CACHE_URL", "locmem://"),
+    l1_timeout=int(os.environ.get("CACHE_L1_TIMEOUT", 5)),
+)
+
+# Пагинация лент постов: "offset" — номера страниц (Paginator),
+# "keyset" — курсорная пагинация по (pub_date, id) без COUNT(*)
+POSTS_PER_PAGE = 10
+POSTS_PAGINATION = os.environ.get("POSTS_PAGINATION", "offset")
+
+# Полнотекстовый поиск по постам (см. posts/search.py): индекс FTS5
+# в SQLite или "posts.search.LikeSearchBackend" — сканирование без индекса.
+# Не задан — выбирается по СУБД (в PostgreSQL таблицы FTS5 нет)
+POST_SEARCH_BACKEND = os.environ.get("POST_SEARCH_BACKEND") or None
+
+# Заголовок Server-Timing с числом и временем SQL-запросов и кеша:
+# сотрудникам всегда, остальным — только при SERVER_TIMING
+SERVER_TIMING = DEBUG
+
+# Детектор лишних SQL-запросов для стенда (см. yatube/query_inspector.py):
+# повторы, однотипные запросы (не меньше QUERY_INSPECTOR_SIMILAR за ответ)
+# и запросы дольше SLOW_QUERY_MS мс пишутся в QUERY_REPORT_FILE
+QUERY_INSPECTOR = os.environ.get("QUERY_INSPECTOR", "0") == "1"
+QUERY_INSPECTOR_SIMILAR = int(os.environ.get("QUERY_INSPECTOR_SIMILAR", 3))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))
+QUERY_REPORT_FILE = os.environ.get(
+    "QUERY_REPORT_FILE", os.path.join(BASE_DIR, "reports", "queries.jsonl"))
+
+# Метрики для Prometheus на /metrics (см. yatube/metrics.py). Воркеры
+# WSGI сохраняют свои значения в METRICS_DIR раз в METRICS_FLUSH_INTERVAL
+# секунд, и любой из них отдаёт сумму; без METRICS_DIR — один процесс
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1))
+# Токен для заголовка Authorization: Bearer; без него /metrics выключен
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Списки админки не считают строки дальше этого числа от текущей страницы:
+# для больших таблиц число страниц берётся из статистики СУБД, для выборок
+# с фильтром показывается нижняя оценка (см. EstimatedCountPaginator)
+ADMIN_COUNT_LIMIT = 10000
+
+# Лента подписок: размер пачки при записи в материализованные ленты
+TIMELINE_BATCH_SIZE = 1000
+# Авторы с числом подписчиков больше порога читаются в ленту при запросе,
+# а не раскладываются при публикации; None (пустая переменная окружения) —
+# раскладывать всех
+TIMELINE_CELEBRITY_THRESHOLD = os.environ.get(
+    "TIMELINE_CELEBRITY_THRESHOLD", "10000")
+TIMELINE_CELEBRITY_THRESHOLD = (int(TIMELINE_CELEBRITY_THRESHOLD)
+                                if TIMELINE_CELEBRITY_THRESHOLD else None)
+
+# Комментарии к посту: размер страницы и время жизни
+# закешированного фрагмента (устаревает со сменой версии ветки
+# при записи и удалении комментариев)
+COMMENTS_PER_PAGE = 50
+COMMENTS_CACHE_TIMEOUT = 60 * 60
+
+# Время жизни закешированных лент: фрагменты сбрасываются сменой
+# версии ленты при записи постов и подписок, а не по TTL
+FEED_CACHE_TIMEOUT = 60 * 60 * 3
+
+# Кеш целых страниц для анонимных посетителей; ключ страницы меняется
+# вместе с её данными, поэтому время жизни ограничивает только объём кеша
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Миниатюры изображений постов: размеры с опциями sorl-thumbnail и форматы.
+# Каждый размер строится в каждом формате; последний формат — запасной
+# для <img>, остальные отдаются через <source> тега <picture>.
+# Строятся после сохранения поста; THUMBNAIL_PIPELINE "thread" — в пуле
+# из THUMBNAIL_WORKERS потоков (по умолчанию), "sync" — сразу, в том же
+# потоке (тесты)
+POST_THUMBNAILS = {
+    "480x170": {"crop": "center", "upscale": True},
+    "960x339": {"crop": "center", "upscale": True},
+    "1440x508": {"crop": "center", "upscale": True},
 }
+POST_THUMBNAIL_DEFAULT = "960x339"
+POST_THUMBNAIL_FORMATS = ("WEBP", "JPEG")
+# Ширина картинки на странице для атрибута sizes
+POST_IMAGE_SIZES = "(min-width: 1200px) 1110px, 100vw"
+
+# Ограничения загружаемых картинок (см. posts/images.py): размер файла,
+# число пикселей до декодирования и большая сторона сохраняемого файла
+POST_IMAGE_MAX_UPLOAD_SIZE = int(
+    os.environ.get("POST_IMAGE_MAX_UPLOAD_SIZE", 20 * 2 ** 20))
+POST_IMAGE_MAX_PIXELS = int(os.environ.get("POST_IMAGE_MAX_PIXELS", 50_000_000))
+POST_IMAGE_MAX_SIDE = int(os.environ.get("POST_IMAGE_MAX_SIDE", 2560))
+POST_IMAGE_JPEG_QUALITY = 85
+# Картинки общие для постов с одинаковыми загрузками и удаляются, когда
+# на них не осталось ссылок, но не раньше чем через столько секунд
+# после последней загрузки того же файла
+POST_IMAGE_RELEASE_GRACE = 60
+THUMBNAIL_PIPELINE = os.environ.get("THUMBNAIL_PIPELINE", "thread")
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+# Картинка, миниатюры которой построить не удалось, столько секунд
+# показывается заглушкой и не ставится в очередь повторно
+THUMBNAIL_FAILURE_TIMEOUT = 60 * 60
+THUMBNAIL_BACKEND = "posts.thumbnails.PostThumbnailBackend"
+# Записи о готовых миниатюрах читаются пачкой на страницу и держатся
+# в памяти воркера (секунды и число записей)
+THUMBNAIL_KVSTORE = "posts.thumbnails.PostKVStore"
+THUMBNAIL_LOCAL_CACHE_TIMEOUT = 300
+THUMBNAIL_LOCAL_CACHE_SIZE = 10000
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from yatube.cache_backends import SQLiteCache, TwoTierCache, caches_from_url
+
+
+class CachesFromUrlTests(SimpleTestCase):
+    def test_backends_by_scheme(self):
+        """Схема CACHE_URL выбирает бэкенд кеша"""
+        backends = {
+            "locmem://": "django.core.cache.backends.locmem.LocMemCache",
+            "redis://localhost:6379/0": "django_redis.cache.RedisCache",
+            "file:///tmp/yatube": (
+                "django.core.cache.backends.filebased.FileBasedCache"),
+            "sqlite:///tmp/cache.db": "yatube.cache_backends.SQLiteCache",
+        }
+        for url, backend in backends.items():
+            with self.subTest(url=url):
+                self.assertEqual(caches_from_url(url)["default"]["BACKEND"],
+                                 backend)
+
+    def test_shared_cache_is_wrapped_into_two_tiers(self):
+        """Общий кеш оборачивается в двухуровневый, локальный — нет"""
+        wrapped = caches_from_url("sqlite:///tmp/cache.db", l1_timeout=5)
+        self.assertEqual(wrapped["default"]["BACKEND"],
+                         "yatube.cache_backends.TwoTierCache")
+        self.assertEqual(wrapped["default"]["OPTIONS"]["L2"]["LOCATION"],
+                         "/tmp/cache.db")
+        local = caches_from_url("locmem://", l1_timeout=5)
+        self.assertEqual(local["default"]["BACKEND"],
+                         "django.core.cache.backends.locmem.LocMemCache")
+
+    def test_relative_path_is_rejected(self):
+        """Относительный путь не превращается молча во временный файл"""
+        for url in ("sqlite://cache.db", "file://yatube", "sqlite://"):
+            with self.subTest(url=url):
+                with self.assertRaises(ValueError):
+                    caches_from_url(url)
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            caches_from_url("ftp://example.com")
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = SQLiteCache(os.path.join(self.dir, "cache.db"), {})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_set_get_delete(self):
+        self.cache.set("key", {"value": 1})
+        self.assertEqual(self.cache.get("key"), {"value": 1})
+        self.cache.set("none", None)
+        self.assertTrue(self.cache.has_key("none"))
+        self.cache.delete("key")
+        self.assertEqual(self.cache.get("key", "default"), "default")
+
+    def test_add_and_incr(self):
+        self.assertTrue(self.cache.add("counter", 1, None))
+        self.assertFalse(self.cache.add("counter", 5))
+        self.assertEqual(self.cache.incr("counter"), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr("missing")
+
+    def test_expired_keys_are_missing(self):
+        self.cache.set("key", "value", timeout=-1)
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_shared_between_instances(self):
+        """Другой процесс с тем же файлом видит те же ключи"""
+        other = SQLiteCache(os.path.join(self.dir, "cache.db"), {})
+        self.cache.set("key", "value")
+        self.assertEqual(other.get("key"), "value")
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierCache("", {"OPTIONS": {
+            "L2": {"BACKEND":
+                   "django.core.cache.backends.locmem.LocMemCache",
+                   "LOCATION": "two-tier-test"},
+            "L1_TIMEOUT": 60,
+        }})
+        self.cache.clear()
+
+    def test_hot_keys_are_served_from_l1(self):
+        """Фрагменты шаблонов читаются из памяти процесса"""
+        key = "template.cache.index_page.abc"
+        self.cache.set(key, "html")
+        self.cache._l2.delete(key)
+        self.assertEqual(self.cache.get(key), "html")
+
+    def test_unversioned_fragments_are_read_from_l2(self):
+        """Фрагмент без версии в ключе сбрасывается удалением, которое
+        не видно L1 других процессов, поэтому в L1 он не попадает"""
+        key = "template.cache.sidebar.abc"
+        self.cache.set(key, "html")
+        self.cache._l2.delete(key)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_mutable_keys_are_read_from_l2(self):
+        """Счётчики версий всегда читаются из общего кеша"""
+        self.cache.add("feed-version:index", 1, None)
+        self.cache._l2.incr("feed-version:index")
+        self.assertEqual(self.cache.get("feed-version:index"), 2)
+        self.assertEqual(self.cache.get_many(["feed-version:index"]),
+                         {"feed-version:index": 2})
@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+from yatube import instrumentation
+from yatube.instrumentation import Histogram
+
+User = get_user_model()
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username="leo")
+        Post.objects.create(text="Война и мир", author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.reset()
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("index"))
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="SQL: [1-9]\d*", '
+            r'tpl;dur=[\d.]+, cache;desc="hit \d+, miss [1-9]\d*"$')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_is_for_staff(self):
+        response = self.client.get(reverse("index"))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+        self.client.force_login(User.objects.create(username="admin",
+                                                    is_staff=True))
+        response = self.client.get(reverse("index"))
+        self.assertTrue(response.has_header("Server-Timing"))
+
+    def test_stats_are_grouped_by_url_name(self):
+        """Повторные запросы анонима берутся из кеша страниц"""
+        for _ in range(3):
+            self.client.get(reverse("index"))
+        self.client.get(reverse("profile", args=[self.author.username]))
+
+        routes = instrumentation.snapshot()["routes"]
+        self.assertEqual(set(routes), {"index", "profile"})
+        index = routes["index"]
+        self.assertEqual(index["time_ms"]["count"], 3)
+        self.assertEqual(index["time_ms"]["buckets"]["+Inf"], 3)
+        self.assertGreater(index["cache_hits"], 0)
+        self.assertGreater(index["template_time_ms"]["sum"], 0)
+        self.assertEqual(routes["profile"]["time_ms"]["count"], 1)
+
+    def test_stats_endpoint_is_for_staff(self):
+        self.client.get(reverse("index"))
+        response = self.client.get(reverse("request_stats"))
+        self.assertEqual(response.status_code, 302)
+
+        self.client.force_login(User.objects.create(username="admin",
+                                                    is_staff=True))
+        response = self.client.get(reverse("request_stats"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("index", response.json()["routes"])
+
+
+class HistogramTests(SimpleTestCase):
+    def test_buckets_and_quantiles(self):
+        histogram = Histogram((10, 100))
+        for value in (1, 5, 20, 50, 80, 500):
+            histogram.observe(value)
+        data = histogram.as_dict()
+        self.assertEqual(data["buckets"], {"10": 2, "100": 5, "+Inf": 6})
+        self.assertEqual(data["count"], 6)
+        self.assertEqual(data["sum"], 656)
+        # Половина наблюдений (3 из 6) — первое в корзине (10, 100]
+        self.assertEqual(histogram.quantile(0.5), 40)
+        self.assertEqual(histogram.quantile(0.99), 100)
+
+    def test_empty(self):
+        self.assertIsNone(Histogram((10,)).quantile(0.5))
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+from posts.thumbnails import thumbnail_generated
+from yatube import metrics
+
+User = get_user_model()
+
+
+@override_settings(METRICS_TOKEN="secret")
+class MetricsViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username="leo")
+        Post.objects.create(text="Война и мир", author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        metrics.install()
+        metrics.registry.reset()
+
+    def scrape(self):
+        response = self.client.get(reverse("metrics"),
+                                   HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith(
+            "text/plain; version=0.0.4"))
+        return response.content.decode()
+
+    def test_request_latency_and_fragment_cache(self):
+        self.client.force_login(self.author)
+        self.client.get(reverse("index"))
+        self.client.get(reverse("index"))
+        text = self.scrape()
+        self.assertIn("# TYPE yatube_http_request_duration_seconds "
+                      "histogram", text)
+        self.assertIn('yatube_http_request_duration_seconds_bucket'
+                      '{view="index",le="+Inf"} 2', text)
+        self.assertIn('yatube_http_request_duration_seconds_count'
+                      '{view="index"} 2', text)
+        self.assertIn('yatube_http_requests_total{status="2xx",'
+                      'view="index"} 2', text)
+        self.assertIn('yatube_fragment_cache_lookups_total'
+                      '{fragment="index_page",result="miss"} 1', text)
+        self.assertIn('yatube_fragment_cache_lookups_total'
+                      '{fragment="index_page",result="hit"} 1', text)
+
+    def test_thumbnail_generation_time(self):
+        thumbnail_generated.send(sender=None, geometry="480x170",
+                                 fmt="WEBP", duration=0.3, ok=True)
+        thumbnail_generated.send(sender=None, geometry="480x170",
+                                 fmt="WEBP", duration=0.1, ok=False)
+        text = self.scrape()
+        self.assertIn('yatube_thumbnail_generation_seconds_bucket'
+                      '{format="WEBP",size="480x170",le="0.25"} 0', text)
+        self.assertIn('yatube_thumbnail_generation_seconds_bucket'
+                      '{format="WEBP",size="480x170",le="0.5"} 1', text)
+        self.assertIn('yatube_thumbnail_failures_total'
+                      '{format="WEBP",size="480x170"} 1', text)
+
+    def test_wrong_token_is_refused(self):
+        for header in ({}, {"HTTP_AUTHORIZATION": "Bearer guess"}):
+            with self.subTest(header=header):
+                response = self.client.get(reverse("metrics"), **header)
+                self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_disabled_without_token(self):
+        """Без токена адрес закрыт и для запросов через прокси
+        с localhost"""
+        response = self.client.get(reverse("metrics"),
+                                   REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 404)
+
+    def test_open_connections(self):
+        self.assertIn('yatube_db_connections_open{alias="default"} 1',
+                      self.scrape())
+
+    def test_workers_are_summed(self):
+        """Метрики других воркеров читаются из их файлов в METRICS_DIR,
+        файлы завершившихся удаляются"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = {
+            "counters": [["yatube_objects_created_total",
+                          {"model": "comment"}, 5]],
+            "histograms": [["yatube_thumbnail_generation_seconds",
+                            {"format": "JPEG", "size": "480x170"},
+                            [1] + [0] * 11 + [0.005]]],
+            "gauges": [["yatube_db_connections_open",
+                        {"alias": "default"}, 3]],
+        }
+        dead_pid = 2 ** 22 + 1
+        for name in (f"{os.getppid()}.json", f"{dead_pid}.json"):
+            with open(os.path.join(directory, name), "w") as file:
+                json.dump(other, file)
+        with open(os.path.join(directory, "notes.json"), "w") as file:
+            file.write("не метрики")
+        metrics.registry.inc("yatube_objects_created_total", 2,
+                             model="comment")
+
+        with override_settings(METRICS_DIR=directory):
+            text = self.scrape()
+        self.assertIn('yatube_objects_created_total{model="comment"} 7',
+                      text)
+        self.assertIn('yatube_thumbnail_generation_seconds_count'
+                      '{format="JPEG",size="480x170"} 1', text)
+        self.assertIn('yatube_db_connections_open{alias="default"} 4',
+                      text)
+        self.assertEqual(
+            sorted(os.listdir(directory)),
+            sorted([f"{os.getpid()}.json", f"{os.getppid()}.json",
+                    "notes.json"]))
+
+
+class CreatedObjectsMetricsTests(TransactionTestCase):
+    def setUp(self):
+        metrics.install()
+        metrics.registry.reset()
+
+    def test_created_rows_are_counted_after_commit(self):
+        author = User.objects.create(username="leo")
+        Post.objects.create(text="Война и мир", author=author)
+        counters = metrics.collect()[0]
+        self.assertEqual(
+            counters[("yatube_objects_created_total",
+                      (("model", "post"),))], 1)
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from yatube.query_inspector import QueryInspectorMiddleware, QueryLog
+
+User = get_user_model()
+
+REPORTS = tempfile.mkdtemp()
+REPORT_FILE = os.path.join(REPORTS, "queries.jsonl")
+
+
+def lookups(request):
+    """Два одинаковых запроса и три однотипных"""
+    User.objects.get(username="leo")
+    User.objects.get(username="leo")
+    for username in ("a", "b", "c"):
+        User.objects.filter(username=username).exists()
+    return HttpResponse()
+
+
+def batches(request):
+    """Два пакета executemany с одним SQL и разными параметрами"""
+    with connection.cursor() as cursor:
+        for names in (("a", "b"), ("c", "d")):
+            cursor.executemany(
+                "UPDATE auth_user SET first_name = %s WHERE username = %s",
+                [(name, name) for name in names])
+    return HttpResponse()
+
+
+@override_settings(QUERY_INSPECTOR=True, QUERY_REPORT_FILE=REPORT_FILE,
+                   QUERY_INSPECTOR_SIMILAR=3, SLOW_QUERY_MS=10 ** 6)
+class QueryInspectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username="pierre")
+        cls.author = User.objects.create(username="leo")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(REPORTS, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        if os.path.exists(REPORT_FILE):
+            os.remove(REPORT_FILE)
+
+    def read_report(self):
+        with open(REPORT_FILE, encoding="utf-8") as report:
+            return [json.loads(line) for line in report]
+
+    def inspect(self, view):
+        request = RequestFactory().get("/lookups/")
+        with self.assertLogs("yatube.query_inspector", "WARNING"):
+            QueryInspectorMiddleware(view)(request)
+
+    def test_duplicates_and_similar_queries_are_reported(self):
+        self.inspect(lookups)
+        (entry,) = self.read_report()
+        self.assertEqual(entry["queries"], 5)
+        findings = {finding["kind"]: finding
+                    for finding in entry["findings"]}
+        self.assertEqual(set(findings), {"duplicate", "similar"})
+        self.assertEqual(findings["duplicate"]["count"], 2)
+        self.assertEqual(findings["duplicate"]["params"], ["leo"])
+        self.assertEqual(findings["similar"]["count"], 3)
+        # Стеки ведут в строки кода проекта, а не в Django
+        frame = findings["duplicate"]["stacks"][0][-1]
+        self.assertEqual(frame[0], os.path.join("yatube", "tests",
+                                                "test_query_inspector.py"))
+        self.assertEqual(frame[2], "lookups")
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_are_reported(self):
+        self.inspect(lambda request: HttpResponse(
+            User.objects.filter(username="leo").exists()))
+        (entry,) = self.read_report()
+        self.assertEqual([finding["kind"] for finding in entry["findings"]],
+                         ["slow"])
+
+    def test_executemany_batches_are_not_duplicates(self):
+        QueryInspectorMiddleware(batches)(RequestFactory().get("/batches/"))
+        self.assertFalse(os.path.exists(REPORT_FILE))
+
+    def test_named_params_are_compared_by_value(self):
+        log = QueryLog()
+        for username in ("a", "b", "a"):
+            log.execute_wrapper(lambda *args: None,
+                                "SELECT %(username)s", {"username": username},
+                                False, {})
+        (duplicate,) = log.findings(10 ** 6, 4)
+        self.assertEqual(duplicate["kind"], "duplicate")
+        self.assertEqual(duplicate["count"], 2)
+        self.assertEqual(duplicate["params"], ["username=a"])
+
+    def test_follow_views_do_not_repeat_queries(self):
+        self.client.force_login(self.reader)
+        self.client.get(reverse("profile_follow", args=["leo"]))
+        self.client.get(reverse("profile_unfollow", args=["leo"]))
+        self.assertFalse(os.path.exists(REPORT_FILE))
+
+    def test_report_command(self):
+        self.inspect(lookups)
+        output = StringIO()
+        call_command("query_report", REPORT_FILE, kind="duplicate",
+                     stdout=output)
+        self.assertIn("Повтор в <unresolved>: 2 запросов в 1 ответах",
+                      output.getvalue())
+        self.assertIn("test_query_inspector.py", output.getvalue())
+        self.assertNotIn("Однотипные", output.getvalue())
+
+    @override_settings(QUERY_INSPECTOR=False)
+    def test_disabled_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInspectorMiddleware(lookups)
@@ -0,0 +1,151 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from yatube.serving import brotli, parse_range
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, FILE_SERVING="django")
+class ServeFileTests(SimpleTestCase):
+    content = b"0123456789"
+    hashed_name = "posts/ab/" + "ab" * 32 + ".txt"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in ("plain.txt", cls.hashed_name):
+            path = os.path.join(MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(cls.content)
+        with open(os.path.join(MEDIA_ROOT, "plain.txt.gz"), "wb") as file:
+            file.write(gzip.compress(cls.content))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_full_file(self):
+        response = self.client.get("/media/plain.txt")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_range(self):
+        """Диапазон байтов отдаётся с кодом 206"""
+        ranges = {"bytes=2-5": (b"2345", "bytes 2-5/10"),
+                  "bytes=7-": (b"789", "bytes 7-9/10"),
+                  "bytes=-3": (b"789", "bytes 7-9/10"),
+                  "bytes=8-100": (b"89", "bytes 8-9/10")}
+        for header, (body, content_range) in ranges.items():
+            with self.subTest(range=header):
+                response = self.client.get("/media/plain.txt",
+                                           HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b"".join(response.streaming_content), body)
+                self.assertEqual(response["Content-Range"], content_range)
+                self.assertEqual(response["Content-Length"], str(len(body)))
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get("/media/plain.txt", HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_stale_if_range_returns_full_file(self):
+        response = self.client.get("/media/plain.txt", HTTP_RANGE="bytes=2-5",
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        etag = self.client.get("/media/plain.txt")["ETag"]
+        response = self.client.get("/media/plain.txt",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_hashed_name_is_immutable(self):
+        """Файлы с хешем содержимого в имени кешируются на год"""
+        response = self.client.get("/media/" + self.hashed_name)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+
+    def test_precompressed_variant(self):
+        """Клиенту, принимающему gzip, отдаётся готовая сжатая копия"""
+        response = self.client.get("/media/plain.txt",
+                                   HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        body = b"".join(response.streaming_content)
+        self.assertEqual(gzip.decompress(body), self.content)
+        plain = self.client.get("/media/plain.txt")
+        self.assertNotEqual(response["ETag"], plain["ETag"])
+
+    def test_refused_encoding(self):
+        for header in ("gzip;q=0", "br", ""):
+            with self.subTest(accept_encoding=header):
+                response = self.client.get("/media/plain.txt",
+                                           HTTP_ACCEPT_ENCODING=header)
+                self.assertFalse(response.has_header("Content-Encoding"))
+                self.assertEqual(b"".join(response.streaming_content),
+                                 self.content)
+
+    def test_missing_and_outside_files(self):
+        for url in ("/media/missing.txt", "/media/../settings.py",
+                    "/media/posts"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(FILE_SERVING="x-accel")
+    def test_x_accel_redirect(self):
+        """В режиме x-accel тело файла отдаёт nginx"""
+        response = self.client.get("/media/plain.txt")
+        self.assertEqual(response["X-Accel-Redirect"],
+                         "/protected/media/plain.txt")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(FILE_SERVING="x-sendfile")
+    def test_x_sendfile(self):
+        response = self.client.get("/media/plain.txt")
+        self.assertEqual(response["X-Sendfile"],
+                         os.path.join(MEDIA_ROOT, "plain.txt"))
+
+
+class CollectStaticTests(SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root, ignore_errors=True)
+
+    def test_fingerprinted_and_precompressed(self):
+        """collectstatic кладёт Bootstrap с хешем в имени и сжатые копии"""
+        with override_settings(STATIC_ROOT=self.static_root):
+            call_command("collectstatic", interactive=False, verbosity=0)
+            url = staticfiles_storage.url("vendor/bootstrap/css/"
+                                          "bootstrap.min.css")
+        self.assertRegex(url, r"bootstrap\.min\.[0-9a-f]{12}\.css$")
+        path = os.path.join(self.static_root,
+                            url[len("/static/"):].replace("/", os.sep))
+        with open(path, "rb") as file:
+            content = file.read()
+        with open(path + ".gz", "rb") as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+        if brotli is not None:
+            with open(path + ".br", "rb") as file:
+                self.assertEqual(brotli.decompress(file.read()), content)
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ignored_headers(self):
+        """Несколько диапазонов и чужие единицы дают весь файл"""
+        for header in ("bytes=0-1,3-4", "items=0-1", "bytes=-"):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 10))
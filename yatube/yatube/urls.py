@@ -15,9 +15,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from django.conf import settings
 from django.conf.urls import handler404, handler500
-from django.conf.urls.static import static
+
+from yatube.instrumentation import request_stats
+from yatube.metrics import metrics_view
+from yatube.serving import file_urls
 
 
 handler404 = "posts.views.page_not_found"  # noqa
@@ -25,14 +27,12 @@ handler500 = "posts.views.server_error"  # noqa
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("stats/requests/", request_stats, name="request_stats"),
+    path("metrics", metrics_view, name="metrics"),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
     path("", include("posts.urls")),
     path("about/", include("about.urls", namespace="about")),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(
-        settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+urlpatterns += file_urls()